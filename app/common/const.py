@@ -31,4 +31,40 @@ class WechatRobotEnum(Enum):
 
     @classmethod
     def get_by_key(cls, key: str) -> "WechatRobotEnum | None":
-        return cls.__members__.get(key)
\ No newline at end of file
+        return cls.__members__.get(key)
+
+"""
+    xxl-job task overlap policy when the max concurrent runs of a task (different jobIds bound to the handler) is reached
+"""
+class TaskOverlapPolicy(Enum):
+    BLOCK = ("BLOCK", "wait until a running trigger finishes")
+    DISCARD = ("DISCARD", "discard the new trigger")
+    REPLACE = ("REPLACE", "cancel the earliest running trigger and run the new one")
+
+    def __init__(self, policy: str, desc: str):
+        self.policy = policy
+        self.desc = desc
+
+
+"""
+    xxl-job task execution pool
+"""
+class TaskPool(Enum):
+    THREAD = ("THREAD", "pyxxl thread pool, for io-bound sync tasks")
+    PROCESS = ("PROCESS", "process pool, for cpu-bound sync tasks")
+
+    def __init__(self, pool: str, desc: str):
+        self.pool = pool
+        self.desc = desc
+
+
+"""
+    keyspace split strategy of broadcast xxl-job tasks
+"""
+class ShardStrategy(Enum):
+    RANGE = ("RANGE", "split the id range evenly, each shard reads a contiguous id range")
+    HASH = ("HASH", "split by the hash of a key column, each shard reads MOD(CRC32(key), total) = index")
+
+    def __init__(self, strategy: str, desc: str):
+        self.strategy = strategy
+        self.desc = desc
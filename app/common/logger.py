@@ -1,5 +1,15 @@
+import atexit
+import json
 import os
+import random
+import re
 import sys
+import threading
+import time
+import traceback
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 
 from loguru import logger
 
@@ -8,6 +18,21 @@ from app.config.trace_.request_context import get_trace_id
 # log path
 filepath = os.getenv("LOG_PATH", "../../log")
 
+# log mode: text = colorized text (development), json = structured json lines (production)
+log_mode = os.getenv("LOG_FORMAT", "text").lower()
+
+# json mode buffered writer settings
+log_batch_size = int(os.getenv("LOG_BATCH_SIZE", "512"))
+log_flush_interval = float(os.getenv("LOG_FLUSH_INTERVAL", "0.2"))
+log_retention_days = 60
+# files written by the json sink, the only ones its retention deletes
+_DAILY_LOG_FILE = re.compile(r"(\d{4}-\d{2}-\d{2})\.log")
+
+# tail based trace debug buffer settings
+log_trace_buffer = os.getenv("LOG_TRACE_BUFFER", "false").lower() in ("1", "true", "yes")
+log_trace_buffer_size = int(os.getenv("LOG_TRACE_BUFFER_SIZE", "200"))
+log_trace_slow_ms = float(os.getenv("LOG_TRACE_SLOW_MS", "3000"))
+
 log_format = (
     "[<green>{time:YYYY-MM-DD HH:mm:ss.SSS}</green>] "
     "[<level>{level: <8}</level>] "
@@ -17,31 +42,392 @@ log_format = (
     "<level>{message}</level>"
 )
 
-# clear built in styles
-logger.remove()
+"""
+Structured json log sink: one writer thread for the file and stdout, batched buffered writes
+"""
+class JsonBatchSink:
 
-# file output configuration
-logger.add(
-    filepath + "/{time:YYYY-MM-DD}.log", # File name template, {time} placeholder automatically includes date
-    rotation="00:00",                    # cut at 00:00 every day
-    retention="60 days",                 # log retention for 60 days
-    level="INFO",                        # minimum output level
-    format=log_format,                   # log format
-    encoding="utf-8",                    # prevent chinese garbled characters
-    enqueue=True,                        # Asynchronous security (recommended for multiple processes/threads)
-    backtrace=True,                      # catch the complete exception chain
-    diagnose=True                        # print more detailed traceback
-)
+    def __init__(self, log_dir: str, stream=sys.stdout, batch_size: int = 512, flush_interval: float = 0.2):
+        self.log_dir = log_dir
+        self.stream = stream
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._records = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._file = None
+        self._file_date = None
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
 
-# console output configuration
-logger.add(
-    sys.stdout,
-    level="INFO",
-    format=log_format,
-    enqueue=True,
-    backtrace=True,
-    diagnose=True
-)
+    def __call__(self, message):
+        # only keep the record reference, serialization happens on the writer thread
+        with self._cond:
+            self._records.append(message.record)
+            if len(self._records) >= self.batch_size:
+                self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._records and not self._closed:
+                    self._cond.wait(self.flush_interval)
+                batch = self._records
+                self._records = deque()
+                closed = self._closed
+            if batch:
+                self._write_batch(batch)
+            if closed:
+                return
+
+    def _write_batch(self, batch):
+        lines = []
+        for record in batch:
+            try:
+                lines.append(serialize_record(record))
+            except Exception as e:
+                lines.append(json.dumps({"level": "ERROR", "message": f"failed to serialize log record: {e}"}))
+        data = "\n".join(lines) + "\n"
+        try:
+            self._rotate_if_needed()
+            self._file.write(data)
+            self._file.flush()
+        except Exception as e:
+            sys.stderr.write(f"failed to write log file: {e}\n")
+        if self.stream is not None:
+            try:
+                self.stream.write(data)
+                self.stream.flush()
+            except Exception:
+                pass
+
+    def _rotate_if_needed(self):
+        # cut at 00:00 every day, same file name template as the text mode
+        today = datetime.now().strftime("%Y-%m-%d")
+        if self._file is not None and self._file_date == today:
+            return
+        if self._file is not None:
+            self._file.close()
+        os.makedirs(self.log_dir, exist_ok=True)
+        self._file = open(os.path.join(self.log_dir, f"{today}.log"), "a", encoding="utf-8", buffering=1024 * 1024)
+        self._file_date = today
+        self._clean_expired()
+
+    def _clean_expired(self):
+        expire_date = (datetime.now() - timedelta(days=log_retention_days)).strftime("%Y-%m-%d")
+        for name in os.listdir(self.log_dir):
+            match = _DAILY_LOG_FILE.fullmatch(name)
+            if match and match.group(1) < expire_date:
+                try:
+                    os.remove(os.path.join(self.log_dir, name))
+                except OSError:
+                    pass
+
+    def stop(self):
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify()
+        self._thread.join(timeout=5)
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+"""
+serialize a loguru record into one json line
+"""
+def serialize_record(record) -> str:
+    data = {
+        "time": record["time"].isoformat(timespec="milliseconds"),
+        "level": record["level"].name,
+        "trace": record["extra"].get("trace", "-"),
+        "thread": record["thread"].name,
+        "logger": record["name"],
+        "function": record["function"],
+        "line": record["line"],
+        "message": record["message"],
+    }
+    # user bound fields, private keys (prefixed with _) are internal markers
+    for key, value in record["extra"].items():
+        if key != "trace" and not key.startswith("_"):
+            data[key] = value
+    exception = record["exception"]
+    if exception is not None:
+        data["exception"] = "".join(traceback.format_exception(exception.type, exception.value, exception.traceback))
+    return json.dumps(data, ensure_ascii=False, default=str)
+
+
+"""
+Tail based debug buffer: DEBUG records of a trace are kept in memory and only written
+when the trace ends in an error or is slower than the latency threshold
+"""
+class TraceLogBuffer:
+
+    # fields restored from the buffered record when it is written to the sinks
+    _REPLAY_FIELDS = ("time", "elapsed", "name", "module", "file", "function", "line", "thread", "process", "exception")
+
+    def __init__(self, enabled: bool = False, max_records: int = 200, slow_ms: float = 3000,
+                 max_traces: int = 10000):
+        self.enabled = enabled
+        self.max_records = max_records
+        self.slow_ms = slow_ms
+        self.max_traces = max_traces
+        self._lock = threading.Lock()
+        # trace id -> [ring buffer of records, failed flag]
+        self._traces: OrderedDict[str, list] = OrderedDict()
+
+    def begin(self, trace_id):
+        if not self.enabled or trace_id is None:
+            return
+        with self._lock:
+            # bounded number of open traces, the oldest one is dropped (never flushed)
+            while len(self._traces) >= self.max_traces:
+                self._traces.popitem(last=False)
+            self._traces[str(trace_id)] = [deque(maxlen=self.max_records), False]
+
+    def capture(self, trace_id, record) -> bool:
+        entry = self._traces.get(str(trace_id))
+        if entry is None:
+            return False
+        entry[0].append(record)
+        return True
+
+    def mark_failed(self, trace_id):
+        entry = self._traces.get(str(trace_id))
+        if entry is not None:
+            entry[1] = True
+
+    def end(self, trace_id, failed: bool = False, elapsed_ms: float = 0.0):
+        if trace_id is None:
+            return
+        with self._lock:
+            entry = self._traces.pop(str(trace_id), None)
+        if entry is None:
+            return
+        records, marked_failed = entry
+        if records and (failed or marked_failed or elapsed_ms >= self.slow_ms):
+            for record in records:
+                self._replay(record)
+
+    def _replay(self, record):
+        def restore(new_record):
+            for field in self._REPLAY_FIELDS:
+                new_record[field] = record[field]
+            new_record["extra"].update(record["extra"])
+            new_record["extra"]["_keep"] = True
+            new_record["extra"]["buffered"] = True
+        logger.patch(restore).log(record["level"].name, record["message"])
+
+
+_trace_buffer = TraceLogBuffer(log_trace_buffer, log_trace_buffer_size, log_trace_slow_ms)
+
+
+"""
+open the debug buffer of a trace (http request or xxl-job run)
+"""
+def begin_trace_buffer(trace_id):
+    _trace_buffer.begin(trace_id)
+
+
+"""
+close the debug buffer of a trace, flush it on error or slowness and drop it otherwise
+"""
+def end_trace_buffer(trace_id, failed: bool = False, elapsed_ms: float = 0.0):
+    _trace_buffer.end(trace_id, failed, elapsed_ms)
+
+
+"""
+context manager version for sync / async code blocks, exceptions mark the trace as failed
+"""
+@contextmanager
+def trace_buffer(trace_id):
+    start = time.perf_counter()
+    failed = True
+    begin_trace_buffer(trace_id)
+    try:
+        yield
+        failed = False
+    finally:
+        end_trace_buffer(trace_id, failed, (time.perf_counter() - start) * 1000)
+
+
+"""
+runtime log level / sampling configuration, can be changed by nacos
+"""
+_default_level = os.getenv("LOG_LEVEL", "INFO").upper()
+_module_levels: dict[str, int] = {}
+_sample_rates: dict[str, float] = {}
+_level_cache: dict[str, int] = {}
+_sample_cache: dict[str, float] = {}
+_config_lock = threading.Lock()
+_handler_ids: list[int] = []
+_json_sink: JsonBatchSink | None = None
+_installed_min_level = None
+
+_DEBUG_NO = logger.level("DEBUG").no
+_INFO_NO = logger.level("INFO").no
+_ERROR_NO = logger.level("ERROR").no
+
+
+def _longest_prefix(name: str, table: dict, default):
+    # match the most specific module prefix, e.g. app.config.db matches app.config.db.db_mysql
+    best, best_len = default, -1
+    for prefix, value in table.items():
+        if (name == prefix or name.startswith(prefix + ".")) and len(prefix) > best_len:
+            best, best_len = value, len(prefix)
+    return best
+
+
+def _module_level(name: str) -> int:
+    level = _level_cache.get(name)
+    if level is None:
+        level = _longest_prefix(name, _module_levels, logger.level(_default_level).no)
+        _level_cache[name] = level
+    return level
+
+
+def _sample_rate(name: str) -> float:
+    rate = _sample_cache.get(name)
+    if rate is None:
+        rate = _longest_prefix(name, _sample_rates, 1.0)
+        _sample_cache[name] = rate
+    return rate
+
+
+def _record_filter(record) -> bool:
+    extra = record["extra"]
+    # the decision is shared by all sinks of the same record
+    keep = extra.get("_keep")
+    if keep is None:
+        name = record["name"] or ""
+        level_no = record["level"].no
+        keep = level_no >= _module_level(name)
+        if keep:
+            if level_no == _INFO_NO:
+                rate = extra.get("sample", _sample_rate(name))
+                keep = rate >= 1.0 or random.random() < rate
+            elif level_no >= _ERROR_NO and _trace_buffer.enabled:
+                _trace_buffer.mark_failed(extra.get("trace"))
+        elif level_no >= _DEBUG_NO and _trace_buffer.enabled:
+            _trace_buffer.capture(extra.get("trace"), record)
+        extra["_keep"] = keep
+    return keep
+
+
+def _effective_min_level() -> int:
+    levels = [logger.level(_default_level).no, *_module_levels.values()]
+    if _trace_buffer.enabled:
+        # debug records must reach the filter to be buffered
+        levels.append(_DEBUG_NO)
+    return min(levels)
+
+
+def _install_handlers():
+    global _json_sink, _installed_min_level
+    min_level = _effective_min_level()
+    if min_level == _installed_min_level:
+        return
+    for handler_id in _handler_ids:
+        logger.remove(handler_id)
+    _handler_ids.clear()
+
+    if log_mode == "json":
+        # variable-inspecting tracebacks are expensive and may leak values, disabled in production
+        if _json_sink is None:
+            _json_sink = JsonBatchSink(filepath, sys.stdout, log_batch_size, log_flush_interval)
+            atexit.register(_json_sink.stop)
+        _handler_ids.append(logger.add(
+            _json_sink,
+            level=min_level,
+            format="{message}",
+            filter=_record_filter,
+            enqueue=False,                   # the sink has its own writer thread
+            backtrace=False,
+            diagnose=False,
+            catch=True
+        ))
+    else:
+        # file output configuration
+        _handler_ids.append(logger.add(
+            filepath + "/{time:YYYY-MM-DD}.log",  # File name template, {time} placeholder automatically includes date
+            rotation="00:00",                     # cut at 00:00 every day
+            retention=f"{log_retention_days} days",  # log retention for 60 days
+            level=min_level,                      # minimum output level
+            filter=_record_filter,                # per module level and sampling
+            format=log_format,                    # log format
+            encoding="utf-8",                     # prevent chinese garbled characters
+            enqueue=True,                         # Asynchronous security (recommended for multiple processes/threads)
+            backtrace=True,                       # catch the complete exception chain
+            diagnose=True                         # print more detailed traceback
+        ))
+        # console output configuration
+        _handler_ids.append(logger.add(
+            sys.stdout,
+            level=min_level,
+            filter=_record_filter,
+            format=log_format,
+            enqueue=True,
+            backtrace=True,
+            diagnose=True
+        ))
+    _installed_min_level = min_level
+
+
+"""
+apply log configuration from nacos
+e.g.
+log:
+  level: INFO
+  modules:
+    app.config.db: DEBUG
+  sampling:
+    app.xxl_job.tasks: 0.1
+  trace_buffer:
+    enabled: true
+    max_records: 200
+    slow_ms: 3000
+"""
+def apply_log_config(log_config: dict | None):
+    global _default_level, _module_levels, _sample_rates, _level_cache, _sample_cache
+    log_config = log_config or {}
+    with _config_lock:
+        try:
+            default_level = str(log_config.get("level", os.getenv("LOG_LEVEL", "INFO"))).upper()
+            module_levels = {k: logger.level(str(v).upper()).no for k, v in (log_config.get("modules") or {}).items()}
+            sample_rates = {k: max(0.0, min(1.0, float(v))) for k, v in (log_config.get("sampling") or {}).items()}
+            logger.level(default_level)
+            buffer_config = log_config.get("trace_buffer") or {}
+            buffer_enabled = bool(buffer_config.get("enabled", log_trace_buffer))
+            buffer_size = int(buffer_config.get("max_records", log_trace_buffer_size))
+            buffer_slow_ms = float(buffer_config.get("slow_ms", log_trace_slow_ms))
+        except (ValueError, TypeError) as e:
+            log.error(f"invalid log configuration, keep the current one: {e}")
+            return
+        _default_level = default_level
+        _module_levels = module_levels
+        _sample_rates = sample_rates
+        _level_cache = {}
+        _sample_cache = {}
+        _trace_buffer.enabled = buffer_enabled
+        _trace_buffer.max_records = buffer_size
+        _trace_buffer.slow_ms = buffer_slow_ms
+        _install_handlers()
+
+
+"""
+flush and stop the json writer, used at process exit
+"""
+def shutdown_log():
+    if _json_sink is not None:
+        _json_sink.stop()
+    logger.complete()
+
+
+# clear built in styles
+logger.remove()
+_install_handlers()
 
 # inject trace id
 def inject_trace_id(record):
@@ -0,0 +1,92 @@
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from app.common.logger import log
+
+# threads of the offload pool, shared by every event loop of the process
+offload_workers = int(os.getenv("OFFLOAD_WORKERS", "32"))
+
+_pool: ThreadPoolExecutor | None = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+# blocking functions already reported as called on the event loop
+_reported = set()
+
+
+def _get_pool() -> ThreadPoolExecutor:
+    global _pool, _pool_pid
+    # a forked child does not inherit the pool threads
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                _pool = ThreadPoolExecutor(max_workers=offload_workers, thread_name_prefix="offload")
+                _pool_pid = os.getpid()
+    return _pool
+
+
+"""
+run a blocking function in the bounded offload pool and await its result, the context variables
+of the caller (trace id, current span) are copied into the worker thread
+
+e.g.
+await run_blocking(get_nacos_client().refresh)
+df = await run_blocking(query_mysql_to_df, "webgis_bi", sql)
+"""
+async def run_blocking(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(_get_pool(), functools.partial(ctx.run, func, *args, **kwargs))
+
+
+"""
+turn a blocking function into a coroutine function that runs it in the offload pool
+
+e.g.
+@offload
+def load_report(day: str) -> dict:
+    ...
+
+report = await load_report("2025-01-01")
+"""
+def offload(func):
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run_blocking(func, *args, **kwargs)
+    return wrapper
+
+
+def _on_event_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+"""
+mark a function as blocking (database, http, file io): the first call made directly on an event
+loop thread is reported with its call stack, and func.run_async(...) awaits it in the offload pool
+"""
+def blocking(func):
+    name = f"{func.__module__}.{func.__qualname__}"
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if name not in _reported and _on_event_loop():
+            _reported.add(name)
+            stack = "".join(traceback.format_stack(limit=8)[:-1])
+            log.warning(f"blocking function {name} called on the event loop thread, "
+                        f"use await {func.__name__}.run_async(...) instead:\n{stack}")
+        return func(*args, **kwargs)
+
+    async def run_async(*args, **kwargs):
+        return await run_blocking(func, *args, **kwargs)
+
+    wrapper.run_async = run_async
+    return wrapper
@@ -1,7 +1,14 @@
 import asyncio
+import atexit
+import concurrent.futures
 import json
+import os
+import queue
 import ssl
+import threading
+import time
 import traceback
+from datetime import datetime
 
 import aiohttp
 import certifi
@@ -9,32 +16,25 @@ import certifi
 from app.common.const import AlarmLevel, WechatRobotEnum
 from app.common.logger import log
 from app.config.nacos_config import get_config
+from app.config.trace_.span import capture_trace_context, get_trace_config, restore_trace_context
+
+# webhook address of the enterprise wechat robot
+WECHAT_WEBHOOK_URL = "https://qyapi.weixin.qq.com/cgi-bin/webhook/send?key={}"
 
 """
-Core methods for sending enterprise WeChat messages
+build the request body of a message
 """
-async def _send_wechat_message_core(
-        robot_key: str,
+def _build_payload(
         msgtype: str,
         content: str,
         mentioned_list: list[str] = None,
         mentioned_mobile_list: list[str] = None
-) -> bool:
-    """
-    Send group chat Markdown messages through enterprise WeChat bots
-
-    :param robot_key: 企业微信机器人Webhook的key
-    :param msgtype: 消息类型 text=纯文本内容 markdown=markdown消息体
-    :param content: markdown格式消息内容 或纯文本text
-    :param mentioned_list: @成员微信号列表，支持["@all"]全体成员
-    :param mentioned_mobile_list: @手机号列表，支持["@all"]
-    :return: 发送成功返回True，否则返回False
-    """
+) -> dict:
     mentioned_list = mentioned_list or []
     mentioned_mobile_list = mentioned_mobile_list or []
 
     if msgtype == "text":
-        payload = {
+        return {
             "msgtype": "text",
             "text": {
                 "content": content,
@@ -43,7 +43,7 @@ async def _send_wechat_message_core(
             }
         }
     elif msgtype == "markdown":
-        payload = {
+        return {
             "msgtype": "markdown",
             "markdown": {
                 "content": content
@@ -52,29 +52,269 @@ async def _send_wechat_message_core(
     else:
         raise ValueError("Currently only supports' text 'and' markdown 'type")
 
+
+"""
+Core methods for sending enterprise WeChat messages
+"""
+async def _send_wechat_message_core(
+        session: aiohttp.ClientSession,
+        robot_key: str,
+        payload: dict
+) -> bool:
+    """
+    Send group chat Markdown messages through enterprise WeChat bots
+
+    :param session: 复用的aiohttp会话（连接池）
+    :param robot_key: 企业微信机器人Webhook的key
+    :param payload: 消息体，由_build_payload生成
+    :return: 发送成功返回True，否则返回False
+    """
     headers = {
         "Content-Type": "application/json"
     }
 
     try:
-        sslcontext = ssl.create_default_context(cafile=certifi.where())
-        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(ssl=sslcontext)) as session:
-            async with session.post(f"https://qyapi.weixin.qq.com/cgi-bin/webhook/send?key={robot_key}", headers=headers, data=json.dumps(payload)) as resp:
-                if resp.status != 200:
-                    log.error(f"发送企微消息失败，状态码: {resp.status}")
-                    return False
-                resp_json = await resp.json()
-                if resp_json.get("errcode") == 0:
-                    # 发送成功
-                    return True
-                else:
-                    log.error(f"发送企微消息失败，错误信息: {resp_json}")
-                    return False
+        async with session.post(WECHAT_WEBHOOK_URL.format(robot_key), headers=headers, data=json.dumps(payload)) as resp:
+            if resp.status != 200:
+                log.error(f"发送企微消息失败，状态码: {resp.status}")
+                return False
+            resp_json = await resp.json()
+            if resp_json.get("errcode") == 0:
+                # 发送成功
+                return True
+            else:
+                log.error(f"发送企微消息失败，错误信息: {resp_json}")
+                return False
     except Exception as ex:
         log.exception(f"发送企微消息失败，错误信息: {ex}")
         return False
 
 
+"""
+Long-lived message dispatcher: a bounded send queue (producers wait up to put_timeout when it is full,
+then the message is dropped), one background event loop thread that sends at most pool_size messages
+at a time over one pooled keep-alive session
+"""
+class WechatDispatcher:
+
+    def __init__(self, queue_size: int = 1000, pool_size: int = 10, send_timeout: float = 30,
+                 put_timeout: float = 5):
+        self.queue_size = queue_size
+        self.pool_size = pool_size
+        self.send_timeout = send_timeout
+        self.put_timeout = put_timeout
+        self.pid = os.getpid()
+        self._closed = False
+        # the send queue, filled by the caller threads and drained by the dispatcher loop
+        self._queue = queue.Queue(maxsize=queue_size)
+        # caller side counters, never taken on the dispatcher loop
+        self._submit_lock = threading.Lock()
+        # messages being sent, only touched on the dispatcher loop
+        self._in_flight: set[asyncio.Task] = set()
+        self._metrics = {
+            "submitted": 0,
+            "sent": 0,
+            "failed": 0,
+            "dropped": 0,
+            "latency_total_ms": 0.0,
+            "latency_max_ms": 0.0,
+        }
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="wechat-dispatcher", daemon=True)
+        self._thread.start()
+        self._session = asyncio.run_coroutine_threadsafe(self._create_session(), self._loop).result()
+
+    async def _create_session(self) -> aiohttp.ClientSession:
+        # the ssl context and the certifi bundle are loaded only once
+        sslcontext = ssl.create_default_context(cafile=certifi.where())
+        connector = aiohttp.TCPConnector(ssl=sslcontext, limit=self.pool_size, keepalive_timeout=60)
+        timeout = aiohttp.ClientTimeout(total=self.send_timeout)
+        # outbound calls carry the X-Trace-Id header of the caller
+        return aiohttp.ClientSession(connector=connector, timeout=timeout, trace_configs=[get_trace_config()])
+
+    def _pump(self):
+        # runs on the dispatcher loop: start queued messages while fewer than pool_size are in flight
+        while len(self._in_flight) < self.pool_size:
+            try:
+                robot_key, payload, trace_state, future = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            task = self._loop.create_task(self._deliver(robot_key, payload, trace_state, future))
+            self._in_flight.add(task)
+            task.add_done_callback(self._on_done)
+
+    def _on_done(self, task: asyncio.Task):
+        self._in_flight.discard(task)
+        self._pump()
+
+    async def _deliver(self, robot_key: str, payload: dict, trace_state: tuple,
+                       future: concurrent.futures.Future):
+        # the task runs on the dispatcher loop, restore the trace of the caller
+        restore_trace_context(trace_state)
+        start = time.perf_counter()
+        success = await _send_wechat_message_core(self._session, robot_key, payload)
+        cost_ms = (time.perf_counter() - start) * 1000
+        self._metrics["sent" if success else "failed"] += 1
+        self._metrics["latency_total_ms"] += cost_ms
+        self._metrics["latency_max_ms"] = max(self._metrics["latency_max_ms"], cost_ms)
+        if not future.done():
+            future.set_result(success)
+
+    async def _flush(self):
+        self._pump()
+        while self._in_flight:
+            await asyncio.wait(set(self._in_flight))
+
+    def submit(self, robot_key: str, payload: dict, block: bool = True):
+        """
+        Put a message into the send queue
+
+        :param block: 队列满时是否阻塞等待（最多put_timeout秒，事件循环内调用不能阻塞）
+        :return: concurrent.futures.Future，结果为是否发送成功，队列满或已关闭时返回None
+        """
+        future = concurrent.futures.Future()
+        if not self._closed:
+            try:
+                self._queue.put((robot_key, payload, capture_trace_context(), future),
+                                block=block, timeout=self.put_timeout)
+            except queue.Full:
+                log.warning(f"wechat send queue is full, message dropped, queued={self._queue.qsize()}")
+            else:
+                with self._submit_lock:
+                    self._metrics["submitted"] += 1
+                self._loop.call_soon_threadsafe(self._pump)
+                return future
+        with self._submit_lock:
+            self._metrics["dropped"] += 1
+        return None
+
+    def send(self, robot_key: str, payload: dict) -> bool:
+        """
+        Synchronous interface, waits for the delivery result outside an event loop,
+        inside a running loop the message is only queued (the loop must not be blocked)
+        """
+        try:
+            asyncio.get_running_loop()
+            in_loop = True
+        except RuntimeError:
+            in_loop = False
+
+        future = self.submit(robot_key, payload, block=not in_loop)
+        if future is None:
+            return False
+        if in_loop:
+            return True
+        try:
+            # queued messages wait for the ones ahead of them
+            return future.result(timeout=self.send_timeout * (self._queue.qsize() // self.pool_size + 2))
+        except Exception as e:
+            log.error(f"wait for wechat message result failed: {e}")
+            return False
+
+    async def send_async(self, robot_key: str, payload: dict) -> bool:
+        """asynchronous interface, awaits the delivery result without blocking the caller loop"""
+        future = self.submit(robot_key, payload, block=False)
+        if future is None:
+            return False
+        return await asyncio.wrap_future(future)
+
+    def get_metrics(self) -> dict:
+        with self._submit_lock:
+            metrics = dict(self._metrics)
+        metrics["queued"] = self._queue.qsize()
+        metrics["in_flight"] = len(self._in_flight)
+        done = metrics["sent"] + metrics["failed"]
+        metrics["latency_avg_ms"] = metrics["latency_total_ms"] / done if done else 0.0
+        return metrics
+
+    def close(self, timeout: float = 10):
+        """stop accepting messages, flush the queued ones and release the session"""
+        if self.pid != os.getpid():
+            # inherited through fork (e.g. the atexit hook of the parent), the loop thread only exists in the parent
+            return
+        with self._submit_lock:
+            if self._closed:
+                return
+            self._closed = True
+        try:
+            asyncio.run_coroutine_threadsafe(self._flush(), self._loop).result(timeout=timeout)
+        except Exception as e:
+            log.error(f"flush wechat send queue failed: {e}")
+        try:
+            asyncio.run_coroutine_threadsafe(self._session.close(), self._loop).result(timeout=timeout)
+        except Exception as e:
+            log.error(f"close wechat session failed: {e}")
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=timeout)
+        log.info(f"wechat dispatcher closed, metrics: {self.get_metrics()}")
+
+
+_dispatcher: WechatDispatcher | None = None
+_dispatcher_lock = threading.Lock()
+
+"""
+get the process wide dispatcher, recreated after fork
+"""
+def get_wechat_dispatcher() -> WechatDispatcher:
+    global _dispatcher
+    if _dispatcher is None or _dispatcher.pid != os.getpid():
+        with _dispatcher_lock:
+            if _dispatcher is None or _dispatcher.pid != os.getpid():
+                dispatcher_config = (get_config().get("wechat") or {}).get("dispatcher") or {}
+                _dispatcher = WechatDispatcher(
+                    queue_size=dispatcher_config.get("queue_size", 1000),
+                    pool_size=dispatcher_config.get("pool_size", 10),
+                    send_timeout=dispatcher_config.get("send_timeout", 30),
+                    put_timeout=dispatcher_config.get("put_timeout", 5),
+                )
+                atexit.register(_dispatcher.close)
+    return _dispatcher
+
+
+"""
+Token bucket rate limiter, the webhook accepts about 20 messages per minute per robot
+"""
+class TokenBucket:
+
+    def __init__(self, rate_per_minute: float = 20, capacity: float = 20):
+        self.rate = rate_per_minute / 60
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def try_acquire(self) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+
+_buckets: dict[str, TokenBucket] = {}
+_buckets_lock = threading.Lock()
+
+"""
+acquire a send token of the robot, False means the robot is over its rate limit
+"""
+def _try_acquire_send_token(robot_key: str) -> bool:
+    bucket = _buckets.get(robot_key)
+    if bucket is None:
+        with _buckets_lock:
+            bucket = _buckets.get(robot_key)
+            if bucket is None:
+                rate = ((get_config().get("wechat") or {}).get("alert") or {}).get("rate_per_minute", 20)
+                bucket = _buckets[robot_key] = TokenBucket(rate, rate)
+    return bucket.try_acquire()
+
+
+def _get_robot_key(robot_enum: WechatRobotEnum) -> str:
+    return get_config()["wechat"]["robot_templates"][robot_enum.robot_name]["key"]
+
+
 """
 send a specified msgtoype message
 """
@@ -86,20 +326,16 @@ def _send_wechat_message_by_type(
         mentioned_mobile_list: list[str] = None
 ) -> bool:
     """
-   Synchronous interface, calling asynchronous sending functions for easy use in synchronous environments
+   Synchronous interface, hands the message to the background dispatcher for easy use in synchronous environments
 
-    :return: 发送是否成功
+    :return: 发送是否成功（事件循环内调用时表示是否成功入队）
     """
-    robot_key = get_config()["wechat"]["robot_templates"][robot_enum.robot_name]["key"]
-    try:
-        loop = asyncio.get_running_loop()
-        if loop.is_running():
-            asyncio.create_task(_send_wechat_message_core(robot_key, msgtype, content, mentioned_list, mentioned_mobile_list))
-            return True
-        else:
-            return asyncio.run(_send_wechat_message_core(robot_key, msgtype, content, mentioned_list, mentioned_mobile_list))
-    except RuntimeError:
-        return asyncio.run(_send_wechat_message_core(robot_key, msgtype, content, mentioned_list, mentioned_mobile_list))
+    robot_key = _get_robot_key(robot_enum)
+    if not _try_acquire_send_token(robot_key):
+        log.warning(f"wechat robot {robot_enum.name} is over its rate limit, message dropped")
+        return False
+    payload = _build_payload(msgtype, content, mentioned_list, mentioned_mobile_list)
+    return get_wechat_dispatcher().send(robot_key, payload)
 
 """
 Send a simple plain text message to a designated group of robots
@@ -134,21 +370,13 @@ def send_markdown_message(
 
 
 """
-Send a markdown template message to the designated group chat robot
+Render a markdown template message of the designated group chat robot
 """
-def send_markdown_template_message(
+def _render_template_content(
         robot_enum: WechatRobotEnum,
         params: list[str],
         alarm_level_enum: AlarmLevel = None,
-) -> bool:
-    """
-    Send a markdown template message to the designated group chat robot
-
-    :param robot_enum: 群机器人枚举
-    :param params: 模版参数列表
-    :param alarm_level_enum: 告警等级枚举
-    :return: 发送是否成功
-    """
+) -> str:
     # 获取消息模版配置
     template_config = get_config()["wechat"]["robot_templates"][robot_enum.robot_name]
     # 消息模版
@@ -162,7 +390,26 @@ def send_markdown_template_message(
     params = tuple(f"{alarm_level_enum.tag_start}{param}{alarm_level_enum.tag_end}" for param in params)
 
     # 替换模版参数
-    content = template_context.format(*params)
+    return template_context.format(*params)
+
+
+"""
+Send a markdown template message to the designated group chat robot
+"""
+def send_markdown_template_message(
+        robot_enum: WechatRobotEnum,
+        params: list[str],
+        alarm_level_enum: AlarmLevel = None,
+) -> bool:
+    """
+    Send a markdown template message to the designated group chat robot
+
+    :param robot_enum: 群机器人枚举
+    :param params: 模版参数列表
+    :param alarm_level_enum: 告警等级枚举
+    :return: 发送是否成功
+    """
+    content = _render_template_content(robot_enum, params, alarm_level_enum)
     return send_markdown_message(robot_enum, content)
 
 """
@@ -175,19 +422,16 @@ def send_markdown_template_exception_message(
         alarm_level_enum: AlarmLevel = None
 ) -> bool:
     """
-    Send an exception template message to the designated group chat robot
+    Send an exception template message to the designated group chat robot,
+    duplicates of the same alert are merged by the alert aggregator
 
     :param robot_enum: 群机器人枚举
     :param err: 异常对象
     :param params: 参数集合
     :param alarm_level_enum: 告警等级枚举
-    :return: 发送是否成功
+    :return: 是否发送成功或已合并到待发送的告警
     """
-    if params is None:
-        params = []
-
-    params.append(_format_exception_markdown(err))
-    return send_markdown_template_message(robot_enum, params, alarm_level_enum)
+    return get_alert_aggregator().add(robot_enum, list(params or []), err, alarm_level_enum)
 
 
 """
@@ -205,6 +449,140 @@ def _format_exception_markdown(err: Exception, max_lines=15) -> str:
     return tb_summary
 
 
+"""
+get the innermost frame of the exception, part of the alert fingerprint
+"""
+def _top_frame(err: Exception) -> str:
+    tb = err.__traceback__
+    if tb is None:
+        return ""
+    while tb.tb_next is not None:
+        tb = tb.tb_next
+    code = tb.tb_frame.f_code
+    return f"{code.co_filename}:{tb.tb_lineno}:{code.co_name}"
+
+
+"""
+Aggregated alert: the first occurrence, the latest exception and the duplicate counters
+"""
+class _AlertEntry:
+
+    def __init__(self, robot_enum: WechatRobotEnum, params: list[str], err: Exception,
+                 alarm_level_enum: AlarmLevel | None, now: float):
+        self.robot_enum = robot_enum
+        self.params = params
+        self.err = err
+        self.alarm_level_enum = alarm_level_enum
+        self.first_seen = now
+        self.last_seen = now
+        self.window_start = now
+        # occurrences not yet sent / occurrences since first seen
+        self.unsent = 1
+        self.total = 1
+
+
+"""
+Alert aggregation layer: merges duplicate exception alerts within a time window and
+enforces the per robot rate limit, tracebacks are formatted only for messages actually sent
+"""
+class AlertAggregator:
+
+    def __init__(self, window_seconds: float = 60, tick_seconds: float = 1):
+        self.window_seconds = window_seconds
+        self.tick_seconds = tick_seconds
+        self.pid = os.getpid()
+        self._entries: dict[tuple, _AlertEntry] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="wechat-alert-aggregator", daemon=True)
+        self._thread.start()
+
+    def add(self, robot_enum: WechatRobotEnum, params: list[str], err: Exception,
+            alarm_level_enum: AlarmLevel = None) -> bool:
+        fingerprint = (robot_enum.robot_name, alarm_level_enum and alarm_level_enum.name,
+                       type(err).__qualname__, _top_frame(err))
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(fingerprint)
+            if entry is not None:
+                # duplicate within the window, merged into the pending summary
+                entry.unsent += 1
+                entry.total += 1
+                entry.last_seen = now
+                entry.err = err
+                return True
+            entry = self._entries[fingerprint] = _AlertEntry(robot_enum, params, err, alarm_level_enum, now)
+        # the first occurrence is sent immediately when the rate limit allows it
+        return self._try_send(entry)
+
+    def _try_send(self, entry: _AlertEntry) -> bool:
+        robot_key = _get_robot_key(entry.robot_enum)
+        if not _try_acquire_send_token(robot_key):
+            return True
+        with self._lock:
+            unsent, total = entry.unsent, entry.total
+            first_seen, last_seen, err = entry.first_seen, entry.last_seen, entry.err
+            entry.unsent = 0
+            entry.window_start = time.time()
+        content = _render_template_content(entry.robot_enum, [*entry.params, _format_exception_markdown(err)],
+                                           entry.alarm_level_enum)
+        if total > 1:
+            content += (f"\n> 告警合并：窗口内重复 {unsent} 次，累计 {total} 次，"
+                        f"首次 {_format_time(first_seen)}，最近 {_format_time(last_seen)}")
+        return get_wechat_dispatcher().send(robot_key, _build_payload("markdown", content))
+
+    def _run(self):
+        while not self._stop.wait(self.tick_seconds):
+            self.flush()
+
+    def flush(self, force: bool = False):
+        """send the summaries whose window has passed, forget the alerts that stopped occurring"""
+        now = time.time()
+        due = []
+        with self._lock:
+            for fingerprint, entry in list(self._entries.items()):
+                if entry.unsent > 0 and (force or now - entry.window_start >= self.window_seconds):
+                    due.append(entry)
+                elif entry.unsent == 0 and now - entry.last_seen >= self.window_seconds:
+                    del self._entries[fingerprint]
+        for entry in due:
+            try:
+                self._try_send(entry)
+            except Exception as e:
+                log.exception(f"send aggregated wechat alert failed: {e}")
+
+    def close(self):
+        if self.pid != os.getpid():
+            # inherited through fork, the flush thread and the pending alerts belong to the parent
+            return
+        self._stop.set()
+        self._thread.join(timeout=5)
+        self.flush(force=True)
+
+
+def _format_time(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S")
+
+
+_aggregator: AlertAggregator | None = None
+_aggregator_lock = threading.Lock()
+
+"""
+get the process wide alert aggregator, recreated after fork
+"""
+def get_alert_aggregator() -> AlertAggregator:
+    global _aggregator
+    if _aggregator is None or _aggregator.pid != os.getpid():
+        with _aggregator_lock:
+            if _aggregator is None or _aggregator.pid != os.getpid():
+                alert_config = (get_config().get("wechat") or {}).get("alert") or {}
+                _aggregator = AlertAggregator(window_seconds=alert_config.get("window_seconds", 60))
+                # registered after the dispatcher, so it runs first at exit and can still send
+                get_wechat_dispatcher()
+                atexit.register(_aggregator.close)
+    return _aggregator
+
+
 if __name__ == "__main__":
     try:
         1 / 0
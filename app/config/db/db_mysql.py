@@ -1,31 +1,107 @@
+import re
 from threading import Lock
-from urllib.parse import quote_plus
 
+import numpy as np
 import pandas as pd
-from sqlalchemy import Engine, create_engine, text
+from pandas.api.types import is_bool_dtype, is_datetime64_any_dtype, is_integer_dtype, is_numeric_dtype
+from sqlalchemy import Engine, event, text
 from sqlalchemy.dialects.mysql import insert
-from tenacity import retry, stop_after_attempt, wait_incrementing, retry_if_exception_type
+from tenacity import retry, stop_after_attempt, wait_incrementing, retry_if_exception_type, retry_if_not_exception_type
 
 from app.common.logger import log
-from app.config.nacos_config import get_db_config
+from app.common.utils.async_util import blocking
+from app.config.db.engine_registry import EngineRegistry
+from app.config.db.query_deadline import (QueryCancelledError, QueryTimeoutError, add_execution_time_hint,
+                                          get_query_scope, guard_query, query_timeout)
+from app.config.db.df_dtype import apply_schema, concat_chunks, infer_schema, memory_report
+from app.config.nacos_config import add_config_listener, get_db_config
+from app.config.trace_.span import start_span, trace_sql_comment
+
+# pymysql batches an executemany INSERT / REPLACE into one multi-row statement only when the statement starts with it
+_BATCH_INSERT_RE = re.compile(r"^(\s*(?:INSERT|REPLACE)\b)", re.IGNORECASE)
+
+"""
+engine registry: one pool per (host, port, user) shared by the databases on it
+"""
+_engine_registry = None
+_registry_lock = Lock()
 
 """
-get database connect configuration
+trace every statement of the engine: trace id sql comment (visible in the MySQL slow log)
+and a span per statement when the trace is sampled
 """
-db_config = get_db_config()
+def _instrument_engine(engine: Engine):
+
+    @event.listens_for(engine, "before_cursor_execute", retval=True)
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._trace_span = start_span("mysql", db=conn.get_execution_options().get("schema"),
+                                             statement=statement[:200], executemany=executemany)
+        return _traced_statement(statement, executemany), parameters
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        trace_span = getattr(context, "_trace_span", None)
+        if trace_span is not None:
+            trace_span.set_attr("rowcount", cursor.rowcount)
+            trace_span.finish()
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(exception_context):
+        trace_span = getattr(exception_context.execution_context, "_trace_span", None)
+        if trace_span is not None:
+            trace_span.set_error(exception_context.original_exception)
+            trace_span.finish()
 
 """
-define a global lock
+statement with the trace id comment and the deadline hint, an executemany INSERT gets the comment
+after its keyword so pymysql still sends the rows as one multi-row INSERT
 """
-_db_lock = Lock()
+def _traced_statement(statement: str, executemany: bool) -> str:
+    scope = get_query_scope()
+    if scope is not None and scope.deadline is not None:
+        statement = add_execution_time_hint(statement, scope.remaining())
+    comment = trace_sql_comment()
+    if not comment:
+        return statement
+    if executemany:
+        traced, count = _BATCH_INSERT_RE.subn(lambda m: f"{m.group(1)} {comment.rstrip()}", statement, count=1)
+        if count:
+            return traced
+    return comment + statement
+
+
+def _on_config_change(config: dict):
+    if _engine_registry is not None:
+        _engine_registry.apply_config(config.get("database"))
+
+
+def get_engine_registry() -> EngineRegistry:
+    global _engine_registry
+    if _engine_registry is None:
+        with _registry_lock:
+            if _engine_registry is None:
+                _engine_registry = EngineRegistry(get_db_config(), instrument=_instrument_engine)
+                add_config_listener(_on_config_change)
+    return _engine_registry
+
 
 """
-sqlalchemy engine dictionary
+sqlalchemy engine dictionary: engines assigned here are used as they are, the other databases
+are looked up in the engine registry (not cached here, idle pools are evicted by the registry)
 """
-db_dict = {}
+class _EngineDict(dict):
+
+    def __missing__(self, db_name: str) -> Engine:
+        return get_engine_registry().get(db_name)
+
+
+db_dict = _EngineDict()
+
 
 """
-create a database engine
+create a database engine: registers the connection settings of the database with the engine
+registry (they win over the nacos database section) and returns its engine
 """
 def get_engine(
         db: str,
@@ -50,28 +126,20 @@ def get_engine(
     Host (str): Database host address, default localhost
     Port (int): database port, default 3306
     Driver (str): database driver, default 'mysql+pymysql'
-    Pool_2 (int): The number of persistent connections in the connection pool
+    Pool_size (int): The number of persistent connections in the pool of (host, port, user)
     Max_overflow (int): The number of temporary connections that overflow from the connection pool
     Pool_timeout (int): Get the timeout time (in seconds) for the connection
-    Pool_decycle (int): Maximum lifecycle of the connection (in seconds)
+    Pool_recycle (int): Maximum lifecycle of the connection (in seconds)
     Echo (boolean): Whether to print SQL logs, default False
 
     Returns:
         Engine: SQLAlchemy Engine 对象
     """
-    conn_str = f"{driver}://{user}:{quote_plus(password)}@{host}:{port}/{db}"
-    engine = create_engine(
-        conn_str,
-        pool_size=pool_size,
-        max_overflow=max_overflow,
-        pool_timeout=pool_timeout,
-        pool_recycle=pool_recycle,
-        pool_pre_ping=True, # 自动检查连接
-        echo=echo,
-    )
+    registry = get_engine_registry()
+    registry.register(db, user=user, password=password, host=host, port=port, driver=driver, pool_size=pool_size,
+                      max_overflow=max_overflow, pool_timeout=pool_timeout, pool_recycle=pool_recycle, echo=echo)
+    return registry.get(db)
 
-    db_dict[db] = engine
-    return engine
 
 """
 retrieve link engine based on database name
@@ -79,21 +147,14 @@ retrieve link engine based on database name
 def get_engine_by_db(db_name: str) -> Engine:
     if db_name is None:
         raise ValueError("db_name cannot be None")
-
-    engine = db_dict.get(db_name)
-    if engine is None:
-        with _db_lock:
-            engine = db_dict.get(db_name)
-            if engine is None:
-                engine = get_engine(db_name, db_config['user'], db_config['password'], db_config['host'],
-                                    db_config['port'])
-    return engine
+    return db_dict[db_name]
 
 
 """
 execute sql statements general
 e.g. create, delete tables etc
 """
+@blocking
 @retry(
     retry=retry_if_exception_type(),
     stop=stop_after_attempt(3),
@@ -115,48 +176,88 @@ def execute_sql(db_name: str, sql: str) -> bool:
 """
 query and convert the result to a dataframe
 """
+@blocking
 @retry(
-    retry=retry_if_exception_type(),
+    # a killed query is not retried, its caller is gone or out of time
+    retry=retry_if_not_exception_type((QueryTimeoutError, QueryCancelledError)),
     stop=stop_after_attempt(3),
     wait=wait_incrementing(start=60, increment=10, max=90),
     reraise=True,
 )
-def query_mysql_to_df(db_name: str, sql: str) -> pd.DataFrame:
+def query_mysql_to_df(
+        db_name: str,
+        sql: str,
+        optimize: bool = False,
+        dtypes: dict[str, str] = None,
+        chunksize: int = 50000,
+        timeout: float = None
+) -> pd.DataFrame:
     """
     Execute MySQL query and return the result as a DataFrame.
     Args:
     db_name: Database name, search for the corresponding engine based on the database name
     sql: The SQL query statement to be executed.
+    optimize: Infer memory efficient dtypes (categoricals for low cardinality strings, downcast
+        integer and float widths, nullable strings), applied chunk by chunk while streaming.
+        The dtypes are inferred from the first chunk only: later chunks that do not fit are
+        upcast silently (a wider integer, float when NULLs show up, object when the column was
+        all NULL in the first chunk), and a category stays a category however many values follow.
+        The memory report against the default dtypes is in result.attrs["memory_report"].
+    dtypes: Per query schema {column: dtype}, overrides the inferred dtypes, also applies without optimize.
+        "downcast_int" / "downcast_float" downcast to the smallest width that fits.
+    chunksize: Rows per streamed chunk when optimize or dtypes is given.
+    timeout: Query deadline in seconds (the earlier of it and the deadline of the route / task),
+        the query is killed on the server when it passes and QueryTimeoutError is raised.
     Returns:
         The query result is of type pandas.DataFrame.
     """
     engine = get_engine_by_db(db_name)
-    with engine.connect() as conn:
-        return pd.read_sql_query(sql, conn)
+    if not optimize and not dtypes:
+        with query_timeout(timeout), engine.connect() as conn, guard_query(engine, conn):
+            return pd.read_sql_query(sql, conn)
+
+    schema = None
+    chunks = []
+    original_bytes = 0
+    # stream_results: server side cursor, the raw result is never fully materialized
+    with query_timeout(timeout), engine.connect().execution_options(stream_results=True) as conn, \
+            guard_query(engine, conn):
+        for chunk in pd.read_sql_query(sql, conn, chunksize=chunksize):
+            original_bytes += int(chunk.memory_usage(deep=True).sum())
+            if schema is None:
+                schema = {**(infer_schema(chunk) if optimize else {}), **(dtypes or {})}
+            chunks.append(apply_schema(chunk, schema))
+    df = concat_chunks(chunks)
+    df.attrs["memory_report"] = memory_report(df, original_bytes)
+    log.info(f"query_mysql_to_df memory report, db={db_name}: {df.attrs['memory_report']}")
+    return df
 
 
 """
     query -> convert results to dict
 """
+@blocking
 @retry(
-    retry=retry_if_exception_type(),
+    # a killed query is not retried, its caller is gone or out of time
+    retry=retry_if_not_exception_type((QueryTimeoutError, QueryCancelledError)),
     stop=stop_after_attempt(3),
     wait=wait_incrementing(start=60, increment=10, max=90),
     reraise=True,
 )
-def query_mysql_to_dict(db_name: str, sql: str, params: dict = None) -> list[dict]:
+def query_mysql_to_dict(db_name: str, sql: str, params: dict = None, timeout: float = None) -> list[dict]:
     """
         Execute MySQL queries and directly return a dictionary list.
 
         Args:
             db_name: The database name is used to obtain the connection engine for get_engine_by_db.
             sql:the sql query statement to be executed
+            timeout: query deadline in seconds, see query_mysql_to_df
 
         Returns:
             Query result, type dictionary list [{col1: val1, col2: val2},...]
         """
     engine = get_engine_by_db(db_name)
-    with engine.connect() as conn:
+    with query_timeout(timeout), engine.connect() as conn, guard_query(engine, conn):
         result = conn.execute(text(sql), params or {})
         # convert the result row to a dictionary list
         return [dict(row) for row in result.mappings().all()]
@@ -166,6 +267,7 @@ def query_mysql_to_dict(db_name: str, sql: str, params: dict = None) -> list[dic
 # update example
 rows_updated = update_mysql('webgis_bi', "UPDATE user SET age = age + 1 WHERE id = :id", {'id': 1001})
 """
+@blocking
 @retry(
     retry=retry_if_exception_type(),
     stop=stop_after_attempt(3),
@@ -184,6 +286,7 @@ def update_mysql(db_name: str, sql: str, params: dict = None) -> int:
 sql_insert_one = "INSERT INTO user (name, age) VALUES (:name, :age)"
 rows_inserted = insert_mysql('webgis_bi', sql_insert_one, {'name': '李四', 'age': 20})
 """
+@blocking
 @retry(
     retry=retry_if_exception_type(),
     stop=stop_after_attempt(3),
@@ -201,6 +304,7 @@ sql_insert_many = "INSERT INTO user (name, age) VALUES (:name, :age)"
 params_list = [{'name': '张三', 'age': 18}, {'name': '王五', 'age': 22}]
 rows_inserted = insert_batch_mysql('webgis_bi', sql_insert_many, params_list)
 """
+@blocking
 @retry(
     retry=retry_if_exception_type(),
     stop=stop_after_attempt(3),
@@ -218,13 +322,14 @@ def insert_batch_mysql(db_name: str, sql: str, params_list: list) -> int:
 """
 Directly store the dataframe data into the database
 """
+@blocking
 @retry(
     retry=retry_if_exception_type(),
     stop=stop_after_attempt(3),
     wait=wait_incrementing(start=60, increment=10, max=90),
     reraise=True,
 )
-def df_to_db(df, db_name, tb_name, UNIQUE_KEY_COLUMNS):
+def df_to_db(df, db_name, tb_name, UNIQUE_KEY_COLUMNS, incremental: bool = False, delete_missing: bool = False):
     """
     Directly store the dataframe data into the database
 
@@ -232,9 +337,25 @@ def df_to_db(df, db_name, tb_name, UNIQUE_KEY_COLUMNS):
     :param db_name: The database name is used to obtain the connection engine for get_engine_by_db.
     :param tb_name: database table name
     :param UNIQUE_KEY_COLUMNS: unique index
+    :param incremental: only write inserted and changed rows, see df_to_db_incremental
+    :param delete_missing: (incremental only) delete the table rows whose keys are not in df
     :return: affect rows
     """
+    if incremental:
+        df_to_db_incremental(df, db_name, tb_name, UNIQUE_KEY_COLUMNS, delete_missing)
+    else:
+        _upsert_df(df, db_name, tb_name, UNIQUE_KEY_COLUMNS)
+
+    engine = get_engine_by_db(db_name)
+    with engine.connect() as conn:
+        result = conn.execute(text(f"SELECT COUNT(*) FROM {tb_name}"))
+        return result.scalar_one()
+
 
+"""
+insert ... on duplicate key update the dataframe rows
+"""
+def _upsert_df(df, db_name, tb_name, UNIQUE_KEY_COLUMNS):
 
     def on_duplicate_update(table, conn, keys, data_iter):
         '''
@@ -256,15 +377,155 @@ def df_to_db(df, db_name, tb_name, UNIQUE_KEY_COLUMNS):
         conn.execute(on_duplicate_stmt)
 
     engine = get_engine_by_db(db_name)
+    df.to_sql(
+        name=tb_name,
+        con=engine,
+        # the registry pools share one connect default database, reflection must name the schema
+        schema=db_name,
+        if_exists='append',
+        index=False,
+        method=on_duplicate_update,
+        chunksize=3000
+    )
+
+
+def _to_int(series: pd.Series) -> pd.Series:
+    series = pd.to_numeric(series, errors="coerce")
+    try:
+        return series.astype("Int64")
+    except (TypeError, ValueError):
+        # fractional values in the table, the rows hash as changed and are rewritten
+        return series.astype("float64")
+
+
+def _to_float(series: pd.Series) -> pd.Series:
+    return pd.to_numeric(series, errors="coerce").astype("float64")
+
+
+def _to_datetime(series: pd.Series) -> pd.Series:
+    series = pd.to_datetime(series, errors="coerce")
+    if series.dt.tz is not None:
+        series = series.dt.tz_localize(None)
+    return series.astype("datetime64[ns]")
+
+
+def _to_string(series: pd.Series) -> pd.Series:
+    return series.astype("string")
+
+
+"""
+normalization of each dataframe column, decided once from the dataframe dtypes: the table rows and
+the dataframe rows are converted the same way before hashing, so values equal after the conversion
+(DECIMAL 1.50 vs float 1.5, a DATE vs a midnight Timestamp, TINYINT vs bool) are not a change
+"""
+def _normalizers(df: pd.DataFrame) -> dict:
+    normalizers = {}
+    for col in df.columns:
+        dtype = df[col].dtype
+        if is_bool_dtype(dtype) or is_integer_dtype(dtype):
+            normalizers[col] = _to_int
+        elif is_numeric_dtype(dtype):
+            normalizers[col] = _to_float
+        elif is_datetime64_any_dtype(dtype):
+            normalizers[col] = _to_datetime
+        else:
+            normalizers[col] = _to_string
+    return normalizers
+
+
+def _normalize(df: pd.DataFrame, columns: list[str], normalizers: dict) -> pd.DataFrame:
+    return pd.DataFrame({col: normalizers[col](df[col]) for col in columns}, index=df.index)
+
+
+def _row_hash(df: pd.DataFrame, columns: list[str], normalizers: dict) -> np.ndarray:
+    if not columns:
+        return np.zeros(len(df), dtype="uint64")
+    return pd.util.hash_pandas_object(_normalize(df, columns, normalizers), index=False).to_numpy()
+
+
+"""
+change only upsert: diff the dataframe against the table by unique key and row content hash,
+write only the inserted and changed rows and optionally delete the keys missing from the dataframe
+
+The table rows are streamed in chunks and only their keys and content hash are kept. Both sides are
+normalized by the dataframe dtypes (see _normalizers) and hashed by pandas, a value that still
+differs after the normalization (e.g. '1.50' vs '1.5' in a string column) counts as a change and the
+row is rewritten. The keys of the dataframe must be unique and not null.
+"""
+def df_to_db_incremental(df, db_name, tb_name, UNIQUE_KEY_COLUMNS, delete_missing: bool = False,
+                         chunksize: int = 50000) -> dict:
+    """
+    :return: {"inserted", "changed", "skipped", "deleted"} row counts
+    """
+    keys = list(UNIQUE_KEY_COLUMNS)
+    content_columns = [col for col in df.columns if col not in keys]
+    if df[keys].isna().any(axis=None):
+        raise ValueError(f"df_to_db incremental {tb_name}: unique key columns {keys} contain nulls")
+    if df.duplicated(keys).any():
+        raise ValueError(f"df_to_db incremental {tb_name}: duplicate unique keys {keys} in the dataframe")
+    normalizers = _normalizers(df)
+    columns_sql = ", ".join(f"`{col}`" for col in keys + content_columns)
+    engine = get_engine_by_db(db_name)
+
+    # existing keys and content hash, streamed in chunks so only keys + hash stay in memory
+    existing_parts = []
+    with engine.connect().execution_options(stream_results=True) as conn:
+        # nullable dtypes: an integer column with NULLs stays exact instead of becoming float64
+        for chunk in pd.read_sql_query(text(f"SELECT {columns_sql} FROM `{tb_name}`"), conn, chunksize=chunksize,
+                                       coerce_float=False, dtype_backend="numpy_nullable"):
+            part = chunk[keys].copy()
+            part["_row_hash"] = _row_hash(chunk, content_columns, normalizers)
+            existing_parts.append(part)
+    existing = pd.concat(existing_parts, ignore_index=True) if existing_parts \
+        else pd.DataFrame({col: pd.Series(dtype=df[col].dtype) for col in keys} | {"_row_hash": pd.Series(dtype="uint64")})
+    # rows with a null key (nullable unique index) can not match a dataframe row, nor be deleted by key
+    existing = existing.dropna(subset=keys)
+
+    incoming = _normalize(df, keys, normalizers).reset_index(drop=True)
+    incoming["_row_hash"] = _row_hash(df, content_columns, normalizers)
+    existing_norm = _normalize(existing, keys, normalizers)
+    existing_norm["_row_hash"] = existing["_row_hash"].to_numpy()
+    # keys equal after the normalization (e.g. a case insensitive collation) are one row of the table
+    existing_norm = existing_norm.drop_duplicates(keys)
+
+    merged = incoming.merge(existing_norm, on=keys, how="left", suffixes=("", "_old"), indicator=True,
+                            validate="one_to_one")
+    is_new = (merged["_merge"] == "left_only").to_numpy()
+    is_changed = ((merged["_merge"] == "both") & (merged["_row_hash"] != merged["_row_hash_old"])).to_numpy()
+    to_write = df[is_new | is_changed]
+    if not to_write.empty:
+        _upsert_df(to_write, db_name, tb_name, UNIQUE_KEY_COLUMNS)
+
+    deleted = 0
+    if delete_missing and not existing.empty:
+        present = _normalize(existing, keys, normalizers).merge(incoming[keys], on=keys, how="left", indicator=True)
+        missing = existing.loc[(present["_merge"] == "left_only").to_numpy(), keys]
+        deleted = _delete_keys(engine, tb_name, keys, missing)
+
+    stats = {
+        "inserted": int(is_new.sum()),
+        "changed": int(is_changed.sum()),
+        "skipped": int(len(df) - is_new.sum() - is_changed.sum()),
+        "deleted": deleted,
+    }
+    log.info(f"df_to_db incremental {db_name}.{tb_name}: {stats}")
+    return stats
+
+
+def _delete_keys(engine: Engine, tb_name: str, keys: list[str], rows: pd.DataFrame, batch_size: int = 1000) -> int:
+    deleted = 0
     with engine.begin() as conn:
-        df.to_sql(
-            name=tb_name,
-            con=engine,
-            if_exists='append',
-            index=False,
-            method=on_duplicate_update,
-            chunksize=3000
-        )
-        result = conn.execute(text(f"SELECT COUNT(*) FROM {tb_name}"))
-        res = result.scalar_one()
-    return res
+        for start in range(0, len(rows), batch_size):
+            batch = rows.iloc[start:start + batch_size]
+            params = {}
+            tuples = []
+            for i, values in enumerate(batch.itertuples(index=False)):
+                names = []
+                for j, value in enumerate(values):
+                    params[f"k{i}_{j}"] = value.item() if hasattr(value, "item") else value
+                    names.append(f":k{i}_{j}")
+                tuples.append(f"({', '.join(names)})")
+            key_sql = ", ".join(f"`{col}`" for col in keys)
+            result = conn.execute(text(f"DELETE FROM `{tb_name}` WHERE ({key_sql}) IN ({', '.join(tuples)})"), params)
+            deleted += result.rowcount
+    return deleted
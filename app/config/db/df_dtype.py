@@ -0,0 +1,83 @@
+import importlib.util
+
+import pandas as pd
+from pandas.api.types import is_float_dtype, is_integer_dtype, is_object_dtype, is_string_dtype
+
+# string columns with a unique ratio below this become categoricals
+CATEGORY_RATIO = 0.5
+
+# pseudo dtypes of a schema: downcast to the smallest integer / float width that fits the chunk
+DOWNCAST_INT = "downcast_int"
+DOWNCAST_FLOAT = "downcast_float"
+
+# arrow backed strings when pyarrow is installed, python backed nullable strings otherwise
+STRING_DTYPE = "string[pyarrow]" if importlib.util.find_spec("pyarrow") else "string"
+
+
+"""
+infer a memory efficient schema from the first chunk of a query
+"""
+def infer_schema(df: pd.DataFrame, category_ratio: float = CATEGORY_RATIO) -> dict[str, str]:
+    schema = {}
+    rows = len(df)
+    for col in df.columns:
+        series = df[col]
+        if is_integer_dtype(series.dtype):
+            schema[col] = DOWNCAST_INT
+        elif is_float_dtype(series.dtype):
+            schema[col] = DOWNCAST_FLOAT
+        elif is_object_dtype(series.dtype) or is_string_dtype(series.dtype):
+            values = series.dropna()
+            # object columns also hold Decimal / date / bytes values, only strings are converted
+            if values.empty or not values.map(type).eq(str).all():
+                continue
+            schema[col] = "category" if rows and values.nunique() / rows <= category_ratio else STRING_DTYPE
+    return schema
+
+
+"""
+apply a schema to one chunk
+"""
+def apply_schema(df: pd.DataFrame, schema: dict[str, str]) -> pd.DataFrame:
+    for col, dtype in schema.items():
+        if col not in df.columns:
+            continue
+        if dtype == DOWNCAST_INT:
+            df[col] = pd.to_numeric(df[col], downcast="integer")
+        elif dtype == DOWNCAST_FLOAT:
+            df[col] = pd.to_numeric(df[col], downcast="float")
+        else:
+            df[col] = df[col].astype(dtype)
+    return df
+
+
+"""
+concat optimized chunks, categoricals keep their dtype (pd.concat falls back to object
+when the categories of the chunks differ)
+"""
+def concat_chunks(chunks: list[pd.DataFrame]) -> pd.DataFrame:
+    if not chunks:
+        return pd.DataFrame()
+    if len(chunks) == 1:
+        return chunks[0]
+    for col in chunks[0].columns:
+        if isinstance(chunks[0][col].dtype, pd.CategoricalDtype):
+            categories = pd.Index(pd.concat([pd.Series(c[col].cat.categories) for c in chunks]).unique())
+            for chunk in chunks:
+                chunk[col] = chunk[col].cat.set_categories(categories)
+    return pd.concat(chunks, ignore_index=True)
+
+
+"""
+memory report of an optimized result compared with the default dtypes
+"""
+def memory_report(df: pd.DataFrame, original_bytes: int) -> dict:
+    optimized_bytes = int(df.memory_usage(deep=True).sum())
+    return {
+        "rows": len(df),
+        "columns": len(df.columns),
+        "original_bytes": original_bytes,
+        "optimized_bytes": optimized_bytes,
+        "saving_pct": round((1 - optimized_bytes / original_bytes) * 100, 1) if original_bytes else 0.0,
+        "dtypes": {col: str(dtype) for col, dtype in df.dtypes.items()},
+    }
@@ -0,0 +1,261 @@
+import threading
+import time
+import weakref
+from urllib.parse import quote_plus
+
+from sqlalchemy import Engine, create_engine, event
+
+from app.common.logger import log
+
+# registry defaults, overridden by the nacos database section
+DEFAULT_POOL_SIZE = 5
+DEFAULT_MAX_OVERFLOW = 10
+DEFAULT_HOST_MAX_CONNECTIONS = 30
+DEFAULT_IDLE_TTL = 600
+
+# a pool used this recently is not evicted to free the host budget
+_BUDGET_EVICT_GRACE = 5
+
+# schema currently selected on each dbapi connection
+_selected_schema = weakref.WeakKeyDictionary()
+
+
+"""
+one pooled engine per (host, port, user), the per database engines are option engines sharing it
+"""
+class _PoolEntry:
+
+    def __init__(self, key: tuple, engine: Engine, max_connections: int):
+        self.key = key
+        self.engine = engine
+        self.max_connections = max_connections
+        self.password = None
+        self.db_engines: dict[str, Engine] = {}
+        self.checked_out = 0
+        self.last_used = time.monotonic()
+        self.evicted = False
+        self.lock = threading.Lock()
+
+    def touch(self) -> bool:
+        """mark the pool as used, False when it was evicted"""
+        with self.lock:
+            self.last_used = time.monotonic()
+            return not self.evicted
+
+
+"""
+Engine registry: databases on the same (host, port, user) share one connection pool and the
+schema of the engine is selected on the connection before each statement (a connection replaced
+after an invalidation included), the connections of a MySQL server (host, port) are capped by a
+budget shared by all its accounts (max_connections is per server, not per account),
+pools idle longer than idle_ttl are disposed, and a change of the nacos database credentials
+or hosts disposes the pools built from the old settings.
+
+nacos configuration:
+database:
+  host: 127.0.0.1
+  port: 3306
+  user: root
+  password: ***
+  pool_size: 5
+  max_overflow: 10
+  host_max_connections: 30     # budget of all pools (all users) on one host:port
+  idle_ttl: 600                # seconds
+  overrides:                   # databases living on another host / account
+    webgis_bi:
+      host: 10.0.0.2
+"""
+class EngineRegistry:
+
+    def __init__(self, db_config: dict, instrument=None):
+        """
+        :param db_config: nacos database 配置
+        :param instrument: 新建引擎的埋点函数 instrument(engine)
+        """
+        self._lock = threading.RLock()
+        self._instrument = instrument
+        self._pools: dict[tuple, _PoolEntry] = {}
+        self._db_config = {}
+        # settings registered in code (get_engine), they win over the nacos configuration
+        self._registered: dict[str, dict] = {}
+        self._closed = threading.Event()
+        self._sweeper = None
+        self.apply_config(db_config)
+
+    def _settings(self, db_name: str) -> dict:
+        overrides = (self._db_config.get("overrides") or {}).get(db_name) or {}
+        return {**self._db_config, **overrides, **self._registered.get(db_name, {})}
+
+    def register(self, db_name: str, **settings):
+        """connection settings of one database given in code (host, port, user, password, pool_size ...)"""
+        with self._lock:
+            if self._registered.get(db_name) == settings:
+                return
+            self._registered[db_name] = settings
+        # a pool built with the previous settings of the database is disposed
+        self._evict(lambda e: db_name in e.db_engines and self._stale(e), "registered settings changed")
+
+    def _stale(self, entry: "_PoolEntry") -> bool:
+        for db_name in list(entry.db_engines) or [None]:
+            settings = self._settings(db_name)
+            if (settings.get("host"), int(settings.get("port", 3306)), settings.get("user")) != entry.key \
+                    or settings.get("password") != entry.password:
+                return True
+        return False
+
+    def get(self, db_name: str) -> Engine:
+        """engine of one database, cheap to call for every statement"""
+        settings = self._settings(db_name)
+        key = (settings["host"], int(settings.get("port", 3306)), settings["user"])
+        entry = self._pools.get(key)
+        if entry is not None:
+            engine = entry.db_engines.get(db_name)
+            # touch: the idle eviction checks last_used under the entry lock, a pool handed out here is kept
+            if engine is not None and entry.touch():
+                return engine
+        with self._lock:
+            entry = self._pools.get(key)
+            if entry is None:
+                entry = self._create_pool(key, settings, db_name)
+            engine = entry.db_engines.get(db_name)
+            if engine is None:
+                engine = entry.engine.execution_options(schema=db_name)
+                entry.db_engines[db_name] = engine
+            entry.touch()
+            return engine
+
+    def _host_allocated(self, host: tuple) -> int:
+        return sum(e.max_connections for k, e in self._pools.items() if k[:2] == host)
+
+    def _create_pool(self, key: tuple, settings: dict, db_name: str) -> _PoolEntry:
+        budget = int(self._db_config.get("host_max_connections", DEFAULT_HOST_MAX_CONNECTIONS))
+        available = budget - self._host_allocated(key[:2])
+        if available < 1:
+            # free the budget held by idle pools of the host before giving up
+            now = time.monotonic()
+            self._evict(lambda e: e.key[:2] == key[:2] and e.checked_out == 0
+                        and now - e.last_used > _BUDGET_EVICT_GRACE, "host budget")
+            available = budget - self._host_allocated(key[:2])
+        if available < 1:
+            raise RuntimeError(f"connection budget of {key[0]}:{key[1]} ({budget}) is used up by other accounts")
+
+        pool_size = min(int(settings.get("pool_size", DEFAULT_POOL_SIZE)), available)
+        max_overflow = min(int(settings.get("max_overflow", DEFAULT_MAX_OVERFLOW)), available - pool_size)
+        host, port, user = key
+        # the first database is the connect default (the dialect needs a default schema), every checkout
+        # selects the schema of its engine, so statements pass schema= for reflection (e.g. to_sql)
+        engine = create_engine(
+            f"{settings.get('driver', 'mysql+pymysql')}://{user}:{quote_plus(str(settings['password']))}"
+            f"@{host}:{port}/{db_name}",
+            pool_size=pool_size,
+            max_overflow=max_overflow,
+            pool_timeout=int(settings.get("pool_timeout", 30)),
+            pool_recycle=int(settings.get("pool_recycle", 3600)),
+            pool_pre_ping=True,
+            echo=bool(settings.get("echo", False)),
+        )
+        entry = _PoolEntry(key, engine, pool_size + max_overflow)
+        entry.password = settings["password"]
+        self._listen(entry)
+        if self._instrument is not None:
+            self._instrument(engine)
+        self._pools[key] = entry
+        self._start_sweeper()
+        log.info(f"engine pool created for {user}@{host}:{port}, pool_size={pool_size} max_overflow={max_overflow}")
+        return entry
+
+    def _listen(self, entry: _PoolEntry):
+        engine = entry.engine
+
+        @event.listens_for(engine, "before_cursor_execute")
+        def select_schema(conn, cursor, statement, parameters, context, executemany):
+            schema = conn.get_execution_options().get("schema")
+            if schema is None:
+                return
+            # checked per statement: a connection invalidated and reconnected inside the same Connection
+            # comes back on the default database of the url
+            dbapi_conn = conn.connection.dbapi_connection
+            # the schema is switched only when the connection last served another database
+            if _selected_schema.get(dbapi_conn) != schema:
+                if hasattr(dbapi_conn, "select_db"):
+                    dbapi_conn.select_db(schema)
+                else:
+                    cursor.execute(f"USE `{schema}`")
+                _selected_schema[dbapi_conn] = schema
+
+        @event.listens_for(engine, "checkout")
+        def on_checkout(dbapi_conn, record, proxy):
+            with entry.lock:
+                entry.checked_out += 1
+                entry.last_used = time.monotonic()
+
+        @event.listens_for(engine, "checkin")
+        def on_checkin(dbapi_conn, record):
+            with entry.lock:
+                entry.checked_out -= 1
+                entry.last_used = time.monotonic()
+
+    def _evict(self, predicate, reason: str) -> int:
+        entries = []
+        with self._lock:
+            for entry in list(self._pools.values()):
+                # decided under the entry lock, so a concurrent get() either sees the flag or refreshed last_used
+                with entry.lock:
+                    if not predicate(entry):
+                        continue
+                    entry.evicted = True
+                del self._pools[entry.key]
+                entries.append(entry)
+        for entry in entries:
+            # closes the idle connections, the bounded pool itself stays: an engine handed out before the
+            # eviction keeps working within the pool limits, checked out connections finish their work
+            entry.engine.pool.dispose()
+            log.info(f"engine pool of {entry.key[2]}@{entry.key[0]}:{entry.key[1]} disposed ({reason})")
+        return len(entries)
+
+    def evict_idle(self) -> int:
+        ttl = float(self._db_config.get("idle_ttl", DEFAULT_IDLE_TTL))
+        now = time.monotonic()
+        return self._evict(lambda e: e.checked_out == 0 and now - e.last_used > ttl, "idle")
+
+    def _start_sweeper(self):
+        if self._sweeper is not None and self._sweeper.is_alive():
+            return
+
+        def sweep():
+            while not self._closed.wait(max(1.0, float(self._db_config.get("idle_ttl", DEFAULT_IDLE_TTL)) / 2)):
+                try:
+                    self.evict_idle()
+                except Exception as e:
+                    log.warning(f"evict idle engine pools failed: {e}")
+
+        self._sweeper = threading.Thread(target=sweep, name="engine-sweeper", daemon=True)
+        self._sweeper.start()
+
+    def apply_config(self, db_config: dict | None):
+        """apply a new nacos database section, pools whose connection settings changed are disposed"""
+        db_config = dict(db_config or {})
+        with self._lock:
+            old_config, self._db_config = self._db_config, db_config
+        if not old_config:
+            return
+
+        def stale(entry: _PoolEntry) -> bool:
+            return self._stale(entry) or \
+                any(old_config.get(k) != db_config.get(k) for k in ("driver", "pool_size", "max_overflow"))
+
+        self._evict(stale, "database configuration changed")
+
+    def get_metrics(self) -> list[dict]:
+        return [{
+            "host": f"{entry.key[0]}:{entry.key[1]}",
+            "user": entry.key[2],
+            "databases": sorted(entry.db_engines),
+            "max_connections": entry.max_connections,
+            "checked_out": entry.checked_out,
+            "idle_seconds": round(time.monotonic() - entry.last_used, 1),
+        } for entry in list(self._pools.values())]
+
+    def dispose_all(self):
+        self._closed.set()
+        self._evict(lambda e: True, "shutdown")
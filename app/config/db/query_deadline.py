@@ -0,0 +1,271 @@
+import asyncio
+import itertools
+import re
+import threading
+import time
+from contextvars import ContextVar
+
+from sqlalchemy import Engine, create_engine, text
+from sqlalchemy.pool import NullPool
+
+from app.common.logger import log
+
+# MySQL errors of an interrupted statement: KILL QUERY / MAX_EXECUTION_TIME exceeded
+_INTERRUPTED_CODES = (1317, 3024)
+
+_SELECT_RE = re.compile(r"^(\s*(?:/\*.*?\*/\s*)*)(select)\b", re.IGNORECASE | re.DOTALL)
+
+_current_scope: ContextVar["QueryScope | None"] = ContextVar("query_scope", default=None)
+
+
+class QueryTimeoutError(TimeoutError):
+    """the query deadline passed, the statement was killed on the server"""
+
+
+class QueryCancelledError(RuntimeError):
+    """the caller went away (client disconnect, xxl-job kill), the statement was killed on the server"""
+
+
+"""
+deadline and cancel flag shared by the queries of one request / task run (and the threads it offloads to)
+"""
+class QueryScope:
+    __slots__ = ("deadline", "reason", "_cancelled")
+
+    def __init__(self, deadline: float | None = None):
+        self.deadline = deadline
+        self.reason = None
+        self._cancelled = False
+
+    def remaining(self) -> float | None:
+        return None if self.deadline is None else self.deadline - time.monotonic()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled
+
+    def cancel(self, reason: str):
+        if not self._cancelled:
+            self.reason = reason
+            self._cancelled = True
+            _killer.wake()
+
+    def expired(self) -> bool:
+        return self._cancelled or (self.deadline is not None and time.monotonic() >= self.deadline)
+
+    def error(self) -> Exception:
+        if self._cancelled:
+            return QueryCancelledError(f"query cancelled: {self.reason}")
+        return QueryTimeoutError("query deadline exceeded")
+
+
+def get_query_scope() -> QueryScope | None:
+    return _current_scope.get()
+
+
+"""
+query deadline of a block, nested deadlines keep the earliest one. Without seconds the block
+shares the enclosing scope (cancellable=True opens its own scope that can be cancelled)
+
+e.g.
+with query_timeout(5):
+    df = query_mysql_to_df("webgis_bi", sql)
+"""
+class query_timeout:
+    __slots__ = ("seconds", "cancellable", "scope", "_token")
+
+    def __init__(self, seconds: float | None = None, cancellable: bool = False):
+        self.seconds = seconds
+        self.cancellable = cancellable
+        self.scope = None
+        self._token = None
+
+    def __enter__(self) -> QueryScope | None:
+        parent = _current_scope.get()
+        if not self.seconds and not self.cancellable:
+            self.scope = parent
+            return parent
+        deadline = time.monotonic() + self.seconds if self.seconds else None
+        if parent is not None and parent.deadline is not None:
+            deadline = parent.deadline if deadline is None else min(deadline, parent.deadline)
+        self.scope = QueryScope(deadline)
+        if parent is not None and parent.cancelled:
+            self.scope.cancel(parent.reason)
+        self._token = _current_scope.set(self.scope)
+        return self.scope
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._token is not None:
+            _current_scope.reset(self._token)
+        return False
+
+
+"""
+per route query deadline, the queries of the request are also killed when the client disconnects
+
+e.g.
+@router.get("/report", dependencies=[Depends(route_query_timeout(10))])
+async def report():
+    return await query_mysql_to_dict.run_async("webgis_bi", sql)
+"""
+def route_query_timeout(seconds: float | None = None, poll_interval: float = 0.5):
+    from fastapi import Request
+
+    async def dependency(request: Request):
+        # read (and cache) the body first, polling for the disconnect consumes the pending receive messages
+        await request.body()
+        with query_timeout(seconds, cancellable=True) as scope:
+            async def watch_disconnect():
+                while not scope.cancelled:
+                    if await request.is_disconnected():
+                        scope.cancel(f"client disconnected from {request.url.path}")
+                        return
+                    await asyncio.sleep(poll_interval)
+
+            watcher = asyncio.create_task(watch_disconnect())
+            try:
+                yield scope
+            finally:
+                watcher.cancel()
+
+    return dependency
+
+
+"""
+add the MAX_EXECUTION_TIME optimizer hint to a select statement (server side enforcement of the
+deadline, MySQL 5.7.8+), other statements are only covered by KILL QUERY
+"""
+def add_execution_time_hint(statement: str, remaining: float) -> str:
+    return _SELECT_RE.sub(lambda m: f"{m.group(1)}{m.group(2)} /*+ MAX_EXECUTION_TIME({max(1, int(remaining * 1000))}) */",
+                          statement, count=1)
+
+
+def _is_interrupted(err: BaseException) -> bool:
+    # the driver error may be wrapped by sqlalchemy (orig) and pandas (__cause__)
+    while err is not None:
+        args = getattr(getattr(err, "orig", err), "args", ())
+        if args and args[0] in _INTERRUPTED_CODES:
+            return True
+        err = err.__cause__
+    return False
+
+
+"""
+Background killer: watches the connections running a query of a scope with a deadline or a
+cancel flag, and runs KILL QUERY on a separate connection when the scope expires
+"""
+class _QueryKiller:
+
+    def __init__(self):
+        lock = threading.Lock()
+        self._cond = threading.Condition(lock)
+        # signalled when the kills of a round finished, unregister waits on it
+        self._kill_done = threading.Condition(lock)
+        self._active: dict[int, tuple] = {}
+        self._killing = set()
+        self._killed = set()
+        self._tokens = itertools.count()
+        self._kill_engines: dict[str, Engine] = {}
+        self._thread = None
+
+    def wake(self):
+        with self._cond:
+            self._cond.notify()
+
+    def register(self, scope: QueryScope, engine: Engine, thread_id: int) -> int:
+        with self._cond:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="query-killer", daemon=True)
+                self._thread.start()
+            token = next(self._tokens)
+            self._active[token] = (scope, engine, thread_id)
+            self._cond.notify()
+            return token
+
+    def unregister(self, token: int) -> bool:
+        """returns whether the query was killed"""
+        with self._cond:
+            self._active.pop(token, None)
+            # a kill in progress finishes before the connection goes back to the pool
+            while token in self._killing:
+                self._kill_done.wait()
+            if token in self._killed:
+                self._killed.discard(token)
+                return True
+            return False
+
+    def _run(self):
+        while True:
+            with self._cond:
+                expired = [(token, entry) for token, entry in self._active.items() if entry[0].expired()]
+                if not expired:
+                    deadlines = [e[0].deadline for e in self._active.values() if e[0].deadline is not None]
+                    timeout = max(0.0, min(deadlines) - time.monotonic()) if deadlines else None
+                    self._cond.wait(timeout)
+                    continue
+                for token, _ in expired:
+                    self._active.pop(token, None)
+                    self._killing.add(token)
+            # the kill connects to the server, register / unregister of other queries do not wait for it
+            for token, (scope, engine, thread_id) in expired:
+                try:
+                    self._kill(engine, thread_id, scope)
+                finally:
+                    with self._cond:
+                        self._killing.discard(token)
+                        self._killed.add(token)
+                        self._kill_done.notify_all()
+
+    def _kill(self, engine: Engine, thread_id: int, scope: QueryScope):
+        url = engine.url.render_as_string(hide_password=False)
+        kill_engine = self._kill_engines.get(url)
+        if kill_engine is None:
+            # not pooled, a kill must not wait for a connection of the exhausted pool
+            kill_engine = self._kill_engines[url] = create_engine(
+                url, poolclass=NullPool, connect_args={"connect_timeout": 5})
+        try:
+            with kill_engine.connect() as conn:
+                conn.execute(text(f"KILL QUERY {int(thread_id)}"))
+            log.warning(f"killed query on connection {thread_id}: {scope.reason or 'deadline exceeded'}")
+        except Exception as e:
+            log.error(f"KILL QUERY {thread_id} failed: {e}")
+
+
+_killer = _QueryKiller()
+
+
+"""
+guard the statements run on conn for the current query scope: a query past its deadline or
+cancelled is killed on the server, the interrupted connection is invalidated (it is not returned
+to the pool with a half read result) and the error becomes QueryTimeoutError / QueryCancelledError
+"""
+class guard_query:
+    __slots__ = ("conn", "engine", "scope", "_token")
+
+    def __init__(self, engine: Engine, conn):
+        self.engine = engine
+        self.conn = conn
+        self.scope = _current_scope.get()
+        self._token = None
+
+    def __enter__(self):
+        scope = self.scope
+        if scope is None:
+            return self
+        if scope.expired():
+            raise scope.error()
+        thread_id = getattr(self.conn.connection.dbapi_connection, "thread_id", None)
+        thread_id = thread_id() if callable(thread_id) else self.conn.exec_driver_sql("SELECT CONNECTION_ID()").scalar()
+        self._token = _killer.register(scope, self.engine, thread_id)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._token is None:
+            return False
+        killed = _killer.unregister(self._token)
+        if killed or (exc is not None and _is_interrupted(exc)):
+            # the connection may hold a half read result, it is closed instead of going back to the pool
+            self.conn.invalidate()
+            if exc is not None:
+                raise self.scope.error() from exc
+        return False
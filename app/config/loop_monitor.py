@@ -0,0 +1,163 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+import weakref
+from contextvars import copy_context
+
+from app.common.logger import log
+from app.config.nacos_config import get_config
+
+# tasks created before the monitor started (or by another task factory) have no known context
+_task_contexts = weakref.WeakKeyDictionary()
+
+_monitors = weakref.WeakKeyDictionary()
+_monitors_lock = threading.Lock()
+
+
+def _context_task_factory(loop, coro, **kwargs):
+    # python 3.11 tasks do not expose their context, keep it to read the trace id of a blocking task
+    context = kwargs.pop("context", None) or copy_context()
+    task = asyncio.Task(coro, loop=loop, context=context, **kwargs)
+    _task_contexts[task] = context
+    return task
+
+
+def _task_context(task):
+    if task is None:
+        return None
+    if hasattr(task, "get_context"):
+        return task.get_context()
+    return _task_contexts.get(task)
+
+
+"""
+Event loop stall detector: a heartbeat callback on the loop and a watchdog thread, when the loop
+does not run the heartbeat for threshold_ms the stack of the loop thread is logged with the
+trace id of the blocking task.
+
+modes:
+  production  at most one stack per report_interval seconds, the other stalls are counted
+  debug       every stall is logged, asyncio debug mode reports slow callbacks as well
+"""
+class LoopStallMonitor:
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, threshold_ms: float = 200, mode: str = "production",
+                 report_interval: float = 60):
+        self.loop = loop
+        self.threshold = threshold_ms / 1000
+        self.mode = mode
+        self.report_interval = report_interval
+        self._interval = max(self.threshold / 4, 0.01)
+        self._last_beat = time.monotonic()
+        self._loop_thread_id = None
+        self._stalled_since = None
+        self._last_report = 0.0
+        self._closed = threading.Event()
+        self._metrics = {"stalls": 0, "suppressed": 0, "max_stall_ms": 0.0, "total_stall_ms": 0.0}
+        self._thread = threading.Thread(target=self._watch, name="loop-monitor", daemon=True)
+
+    def start(self):
+        """must be called on the loop thread"""
+        self._loop_thread_id = threading.get_ident()
+        if self.loop.get_task_factory() is None and sys.version_info < (3, 12):
+            self.loop.set_task_factory(_context_task_factory)
+        if self.mode == "debug":
+            self.loop.set_debug(True)
+            self.loop.slow_callback_duration = self.threshold
+        self._beat()
+        self._thread.start()
+
+    def stop(self):
+        self._closed.set()
+
+    def _beat(self):
+        now = time.monotonic()
+        stalled_since = self._stalled_since
+        if stalled_since is not None:
+            self._stalled_since = None
+            stall_ms = (now - stalled_since) * 1000
+            self._metrics["total_stall_ms"] += stall_ms
+            self._metrics["max_stall_ms"] = max(self._metrics["max_stall_ms"], stall_ms)
+            if self.mode == "debug":
+                log.warning(f"event loop recovered after a {stall_ms:.0f}ms stall")
+        self._last_beat = now
+        if not self._closed.is_set() and not self.loop.is_closed():
+            self.loop.call_later(self._interval, self._beat)
+
+    def _watch(self):
+        while not self._closed.wait(self._interval):
+            if self.loop.is_closed():
+                return
+            last_beat = self._last_beat
+            # the heartbeat is due every interval, anything later is the loop being blocked
+            lag = time.monotonic() - last_beat - self._interval
+            if lag < self.threshold or self._stalled_since is not None:
+                continue
+            self._stalled_since = last_beat + self._interval
+            self._metrics["stalls"] += 1
+            self._report(lag)
+
+    def _report(self, lag: float):
+        now = time.monotonic()
+        if self.mode != "debug" and now - self._last_report < self.report_interval:
+            self._metrics["suppressed"] += 1
+            return
+        self._last_report = now
+        frame = sys._current_frames().get(self._loop_thread_id)
+        stack = "".join(traceback.format_stack(frame)) if frame is not None else "-"
+        try:
+            task = asyncio.current_task(self.loop)
+        except RuntimeError:
+            task = None
+        msg = (f"event loop blocked for {lag * 1000:.0f}ms (threshold {self.threshold * 1000:.0f}ms), "
+               f"task={task.get_name() if task is not None else '-'}")
+        if self._metrics["suppressed"]:
+            msg += f", {self._metrics['suppressed']} stalls not reported since the last report"
+            self._metrics["suppressed"] = 0
+        msg += f", blocking stack:\n{stack}"
+        context = _task_context(task)
+        if context is not None:
+            # log in a copy of the task context so the record carries its trace id
+            context.copy().run(log.warning, msg)
+        else:
+            log.warning(msg)
+
+    def get_metrics(self) -> dict:
+        return dict(self._metrics)
+
+
+"""
+start the stall monitor of the running loop (once per loop), called at startup with the nacos
+loop_monitor section (read from the config when not given)
+e.g.
+loop_monitor:
+  mode: production      # off / production / debug
+  threshold_ms: 200
+  report_interval: 60
+"""
+def start_loop_monitor(monitor_config: dict = None) -> LoopStallMonitor | None:
+    loop = asyncio.get_running_loop()
+    if loop in _monitors:
+        return _monitors[loop]
+    with _monitors_lock:
+        if loop in _monitors:
+            return _monitors[loop]
+        if monitor_config is None:
+            monitor_config = get_config().get("loop_monitor") or {}
+        mode = str(monitor_config.get("mode", os.getenv("LOOP_MONITOR", "production"))).lower()
+        if mode == "off":
+            _monitors[loop] = None
+            return None
+        monitor = LoopStallMonitor(
+            loop,
+            threshold_ms=float(monitor_config.get("threshold_ms", os.getenv("LOOP_STALL_MS", "200"))),
+            mode=mode,
+            report_interval=float(monitor_config.get("report_interval", 60)),
+        )
+        monitor.start()
+        _monitors[loop] = monitor
+        log.info(f"event loop stall monitor started, mode={mode} threshold={monitor.threshold * 1000:.0f}ms")
+        return monitor
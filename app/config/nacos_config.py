@@ -1,10 +1,13 @@
 import os
+import time
 from threading import Lock
 
 import nacos
 import yaml
 
-from app.common.logger import log
+from app.common.logger import log, apply_log_config
+from app.config.shared_config import SharedConfigSnapshot, json_round_trips, shared_config_enabled
+from app.config.trace_.span import apply_trace_config, span
 
 # base dir
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -16,6 +19,8 @@ class NacosConfigManager:
     _initialized = False
     _config_raw = None
     _config_yaml = None
+    _shared = None
+    _client = None
 
     def __new__(cls, *args, **kwargs):
         if not cls._instance:
@@ -27,38 +32,131 @@ class NacosConfigManager:
         if not self._initialized:
             with self._lock:
                 if not self._initialized:
-                    self.client = nacos.NacosClient(
-                        server_addr,
-                        namespace=namespace,
-                        username=username,
-                        password=password
-                    )
+                    # the client (and its nacos login) is created by the first fetch, in node local mode
+                    # only the leader process of the node fetches
+                    self._client_args = (server_addr, namespace, username, password)
                     self.data_id = data_id
                     self.group = group
                     self._initialized = True
-                    # Pull the latest configuration during initialization
-                    self.fetch_config()
+                    if shared_config_enabled():
+                        # node local mode: the processes of the node share one fetched and parsed snapshot
+                        self._init_shared(namespace)
+                    else:
+                        # Pull the latest configuration during initialization
+                        self.fetch_config()
                     # monitor configuration change events
                     # self.client.add_config_watcher(self.data_id, self.group, self.refresh)
 
     def fetch_config(self):
         try:
-            content = self.client.get_config(self.data_id, self.group)
+            if self._shared is not None:
+                # serialize the writers of the node, the readers never lock
+                with self._shared.write_lock():
+                    self._fetch_and_publish()
+                self._sync_shared()
+                return
+            content = self._get_content()
             if content is None:
-                log.warning(f"received nacos configuration content is empty，dataId={self.data_id}")
                 return
-            self._config_raw = content
-            self._config_yaml = yaml.safe_load(content)
+            self._apply_config(content, yaml.safe_load(content))
             log.info(f"successfully loaded and parsed nacos configuration，dataId={self.data_id}")
         except Exception as e:
             log.error(f"failed to retrieve or parse configuration: {e}")
 
+    @property
+    def client(self) -> nacos.NacosClient:
+        if self._client is None:
+            server_addr, namespace, username, password = self._client_args
+            self._client = nacos.NacosClient(server_addr, namespace=namespace, username=username, password=password)
+        return self._client
+
+    def _fetch_and_publish(self):
+        content = self._get_content()
+        if content is None:
+            return
+        current = self._shared.read()
+        if current is not None and current["raw"] == content:
+            # unchanged, only the fetch time moves: starting processes trust a recently fetched snapshot
+            self._shared.publish({**current, "fetched_at": time.time()})
+            return
+        config_yaml = yaml.safe_load(content)
+        # a config json can not represent exactly (e.g. int keys) is shared raw, each process parses it
+        version = self._shared.publish({"raw": content, "yaml": config_yaml if json_round_trips(config_yaml) else None,
+                                        "fetched_at": time.time()})
+        # the publishing process already holds the new sequence, _sync_shared would skip it
+        self._apply_config(content, config_yaml)
+        log.info(f"published nacos configuration snapshot version {version}，dataId={self.data_id}")
+
+    def _get_content(self):
+        with span("nacos.get_config", data_id=self.data_id):
+            content = self.client.get_config(self.data_id, self.group)
+        if content is None:
+            log.warning(f"received nacos configuration content is empty，dataId={self.data_id}")
+        return content
+
+    def _apply_config(self, content, config_yaml):
+        self._config_raw = content
+        self._config_yaml = config_yaml
+        # runtime log level / sampling overrides
+        apply_log_config((self._config_yaml or {}).get("log"))
+        apply_trace_config((self._config_yaml or {}).get("trace"))
+        for listener in list(_config_listeners):
+            try:
+                listener(self._config_yaml or {})
+            except Exception as e:
+                log.error(f"nacos configuration listener {listener.__name__} failed: {e}")
+
+    def _init_shared(self, namespace):
+        self._shared = SharedConfigSnapshot(f"{namespace}-{self.group}-{self.data_id}")
+        interval = float(os.getenv("NACOS_REFRESH_INTERVAL", "30"))
+        # the snapshot outlives the processes (e.g. left by the previous deployment), it is trusted only
+        # when the leader of the node fetched it recently
+        max_age = max(3 * interval, 10.0)
+        if self._shared.try_lead():
+            with self._shared.write_lock():
+                if not self._snapshot_fresh(max_age):
+                    self._fetch_and_publish()
+        else:
+            deadline = time.monotonic() + 10
+            while not self._snapshot_fresh(max_age) and time.monotonic() < deadline:
+                time.sleep(0.1)
+            if not self._snapshot_fresh(max_age):
+                log.warning(f"no fresh nacos configuration snapshot from the leader, fetching，dataId={self.data_id}")
+                with self._shared.write_lock():
+                    if not self._snapshot_fresh(max_age):
+                        self._fetch_and_publish()
+        self._sync_shared()
+        # the leader refreshes from nacos, every process syncs the snapshot (config listeners run everywhere)
+        self._shared.start_refresher(self.fetch_config, interval, sync=self._sync_shared)
+        log.info(f"nacos configuration shared through {self._shared.path}")
+
+    def _snapshot_fresh(self, max_age: float) -> bool:
+        snapshot = self._shared.read()
+        return snapshot is not None and time.time() - snapshot.get("fetched_at", 0) <= max_age
+
+    def _sync_shared(self):
+        # one 8 byte sequence read when nothing changed
+        snapshot = self._shared.read()
+        if snapshot is None or snapshot["raw"] is self._config_raw:
+            return
+        if snapshot["raw"] == self._config_raw:
+            # republished with a new fetch time only
+            self._config_raw = snapshot["raw"]
+            return
+        config_yaml = snapshot["yaml"] if snapshot["yaml"] is not None else yaml.safe_load(snapshot["raw"])
+        self._apply_config(snapshot["raw"], config_yaml)
+        log.info(f"loaded nacos configuration snapshot，dataId={self.data_id}")
+
     def get_raw_config(self):
+        if self._shared is not None:
+            self._sync_shared()
         if self._config_raw is None:
             self.fetch_config()
         return self._config_raw
 
     def get_yaml_config(self):
+        if self._shared is not None:
+            self._sync_shared()
         if self._config_yaml is None:
             self.fetch_config()
         return self._config_yaml
@@ -84,6 +182,16 @@ def get_nacos_client() -> NacosConfigManager:
 
 _nacos_base_config = None
 
+# callbacks run with the parsed configuration after every successful fetch
+_config_listeners = []
+
+
+"""
+register a callback for nacos configuration refreshes, e.g. to rebuild clients from changed settings
+"""
+def add_config_listener(listener):
+    _config_listeners.append(listener)
+
 """
 read nacos yaml file configuration
 """
@@ -0,0 +1,222 @@
+import json
+import mmap
+import os
+import re
+import stat
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from datetime import date, datetime
+
+from app.common.logger import log
+
+try:
+    import fcntl
+except ImportError:  # windows: no flock, the shared snapshot is not available
+    fcntl = None
+
+# magic, seq, version, length, crc32
+_HEADER = struct.Struct("<8sQQQI")
+_HEADER_SIZE = 64
+_SEQ = struct.Struct("<Q")
+_SEQ_OFFSET = 8
+_MAGIC = b"PYMSCFG1"
+_INITIAL_SIZE = 256 * 1024
+
+
+def shared_config_enabled() -> bool:
+    return fcntl is not None and os.getenv("NACOS_SHARED_CONFIG", "false").lower() in ("1", "true", "yes")
+
+
+def _default_dir() -> str:
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    # private per user directory, the shared base directories are world writable
+    return os.getenv("SHARED_CONFIG_DIR") or os.path.join(base, f"pyms-config-{os.getuid()}")
+
+
+def _private_dir(directory: str):
+    try:
+        os.mkdir(directory, 0o700)
+    except FileExistsError:
+        pass
+    st = os.lstat(directory)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+        raise PermissionError(f"{directory} must be a directory owned by uid {os.getuid()} with mode 0700")
+
+
+def _open_private(path: str) -> int:
+    # no symlink following, and the file must be ours and private (another user may have created it first)
+    fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, 0o600)
+    st = os.fstat(fd)
+    if not stat.S_ISREG(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+        os.close(fd)
+        raise PermissionError(f"{path} must be a regular file owned by uid {os.getuid()} with mode 0600")
+    return fd
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return {"__datetime__": value.isoformat()}
+    if isinstance(value, date):
+        return {"__date__": value.isoformat()}
+    raise TypeError(f"{type(value).__name__} is not json serializable")
+
+
+def _json_hook(obj: dict):
+    if len(obj) == 1:
+        if "__datetime__" in obj:
+            return datetime.fromisoformat(obj["__datetime__"])
+        if "__date__" in obj:
+            return date.fromisoformat(obj["__date__"])
+    return obj
+
+
+def _encode(value) -> bytes:
+    return json.dumps(value, default=_json_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _decode(payload: bytes):
+    return json.loads(payload, object_hook=_json_hook)
+
+
+"""
+whether a value survives the json snapshot unchanged (e.g. yaml int keys or sets do not)
+"""
+def json_round_trips(value) -> bool:
+    try:
+        return _decode(_encode(value)) == value
+    except (TypeError, ValueError):
+        return False
+
+
+"""
+Node local config snapshot: the parsed nacos config is published to a memory mapped file,
+the processes of the node map it and pick up a new version with one 8 byte sequence read.
+The payload is json (never pickle: the file is only as trusted as the directory it lives in),
+the files are kept in a private 0700 directory and opened without following symlinks.
+
+The header sequence is a seqlock: odd while a writer updates the payload, readers copy the
+payload without locking and retry when the sequence moved during the copy. Writers are
+serialized by a flock, one process per node (the flock leader) refreshes from nacos.
+"""
+class SharedConfigSnapshot:
+
+    def __init__(self, name: str, directory: str = None):
+        name = re.sub(r"[^A-Za-z0-9_.-]", "_", name)
+        directory = directory or _default_dir()
+        _private_dir(directory)
+        self.path = os.path.join(directory, f"pyms-config-{name}.snapshot")
+        self._write_lock_path = self.path + ".lock"
+        self._leader_lock_path = self.path + ".leader"
+        self._fd = _open_private(self.path)
+        self._mm = None
+        self._seq = None
+        self._value = None
+        self._leader_fd = None
+        self._refresher = None
+        with self.write_lock():
+            if os.fstat(self._fd).st_size < _HEADER_SIZE:
+                os.ftruncate(self._fd, _INITIAL_SIZE)
+                self._map()
+                self._mm[:_HEADER.size] = _HEADER.pack(_MAGIC, 0, 0, 0, 0)
+        if self._mm is None:
+            self._map()
+
+    def _map(self):
+        # the old mapping is not closed, another thread may still be reading it
+        self._mm = mmap.mmap(self._fd, os.fstat(self._fd).st_size)
+
+    @contextmanager
+    def write_lock(self):
+        fd = _open_private(self._write_lock_path)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    def read(self):
+        """latest published value (None before the first publish), decoded only when the sequence moved"""
+        for attempt in range(1000):
+            mm = self._mm
+            seq = _SEQ.unpack_from(mm, _SEQ_OFFSET)[0]
+            if seq == self._seq:
+                return self._value
+            if seq & 1:
+                # a writer is updating the payload
+                time.sleep(0.0001 if attempt < 100 else 0.001)
+                continue
+            magic, _, version, length, crc = _HEADER.unpack_from(mm, 0)
+            if _HEADER_SIZE + length > len(mm):
+                # the writer grew the file
+                self._map()
+                continue
+            payload = mm[_HEADER_SIZE:_HEADER_SIZE + length]
+            if _SEQ.unpack_from(mm, _SEQ_OFFSET)[0] != seq:
+                continue
+            if magic != _MAGIC or (length and zlib.crc32(payload) != crc):
+                continue
+            value = _decode(payload) if length else None
+            self._value, self._seq = value, seq
+            return value
+        raise TimeoutError(f"no consistent config snapshot in {self.path}")
+
+    def publish(self, value) -> int:
+        """publish a new value, the caller holds write_lock(), returns the new version"""
+        payload = _encode(value)
+        if _HEADER_SIZE + len(payload) > len(self._mm):
+            os.ftruncate(self._fd, max(len(self._mm) * 2, _HEADER_SIZE + len(payload)))
+            self._map()
+        seq = _SEQ.unpack_from(self._mm, _SEQ_OFFSET)[0]
+        version = _HEADER.unpack_from(self._mm, 0)[2] + 1
+        _SEQ.pack_into(self._mm, _SEQ_OFFSET, seq + 1)
+        self._mm[_HEADER_SIZE:_HEADER_SIZE + len(payload)] = payload
+        _HEADER.pack_into(self._mm, 0, _MAGIC, seq + 1, version, len(payload), zlib.crc32(payload))
+        _SEQ.pack_into(self._mm, _SEQ_OFFSET, seq + 2)
+        self._seq = seq + 2
+        self._value = value
+        return version
+
+    def try_lead(self) -> bool:
+        """become the refreshing process of the node, the lock is released when the process exits"""
+        if self._leader_fd is not None:
+            return True
+        fd = _open_private(self._leader_lock_path)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self._leader_fd = fd
+        return True
+
+    def start_refresher(self, refresh, interval: float, sync=None, sync_interval: float = 1.0):
+        """
+        every process runs the loop: only the leader calls refresh every interval, another process takes
+        over within one interval when the leader exits, and every process calls sync every sync_interval
+        (picks up the snapshot of the leader without waiting for a reader)
+        """
+        if self._refresher is not None or (interval <= 0 and sync is None):
+            return
+
+        def loop():
+            next_refresh = time.monotonic() + interval
+            while True:
+                time.sleep(min(sync_interval, interval) if interval > 0 else sync_interval)
+                try:
+                    if interval > 0 and time.monotonic() >= next_refresh:
+                        next_refresh = time.monotonic() + interval
+                        if self.try_lead():
+                            refresh()
+                            continue
+                    if sync is not None:
+                        sync()
+                except Exception as e:
+                    log.warning(f"refresh shared config snapshot failed: {e}")
+
+        self._refresher = threading.Thread(target=loop, name="shared-config-refresher", daemon=True)
+        self._refresher.start()
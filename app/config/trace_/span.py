@@ -0,0 +1,340 @@
+import atexit
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from collections import deque
+from contextvars import ContextVar
+
+import aiohttp
+import requests
+
+from app.common.logger import log
+from app.config.trace_.request_context import get_trace_id, set_trace_id
+
+# span tracing is off unless a sample rate is configured
+trace_sample_rate = float(os.getenv("TRACE_SAMPLE_RATE", "0"))
+# file:/path/spans.jsonl or otlp:http://127.0.0.1:4318/v1/traces
+trace_exporter = os.getenv("TRACE_EXPORTER", "")
+service_name = os.getenv("SERVICE_NAME", "py-micro-service")
+
+# characters of a trace id that are not copied into the sql comment
+_UNSAFE_SQL_CHARS = re.compile(r"[^A-Za-z0-9_-]")
+
+# current span of the sampled trace, None when the trace is not sampled
+_current_span: ContextVar["Span | None"] = ContextVar("span", default=None)
+
+
+"""
+One timed operation of a sampled trace, the root span collects the finished spans of its trace
+"""
+class Span:
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "root", "attrs", "start_ns", "end_ns", "error", "spans")
+
+    def __init__(self, name: str, trace_id: str, parent: "Span | None" = None, attrs: dict = None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent is not None else None
+        self.root = parent.root if parent is not None else self
+        self.attrs = attrs or {}
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.error = None
+        self.spans = [] if parent is None else None
+
+    def set_attr(self, key: str, value):
+        self.attrs[key] = value
+
+    def set_error(self, err: BaseException):
+        self.error = f"{type(err).__name__}: {err}"
+
+    def finish(self):
+        if self.end_ns is None:
+            self.end_ns = time.time_ns()
+            self.root.spans.append(self)
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_ns": self.start_ns,
+            "duration_ms": (self.end_ns - self.start_ns) / 1e6 if self.end_ns else None,
+            "attrs": self.attrs,
+            "error": self.error,
+        }
+
+
+"""
+child span context manager, does nothing (one context variable lookup) when the trace is not sampled
+
+e.g.
+with span("load orders", db="webgis_bi"):
+    ...
+"""
+class span:
+    __slots__ = ("name", "attrs", "_span", "_token")
+
+    def __init__(self, name: str, **attrs):
+        self.name = name
+        self.attrs = attrs
+        self._span = None
+        self._token = None
+
+    def __enter__(self) -> Span | None:
+        parent = _current_span.get()
+        if parent is None:
+            return None
+        self._span = Span(self.name, parent.trace_id, parent, self.attrs)
+        self._token = _current_span.set(self._span)
+        return self._span
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._span is not None:
+            if exc is not None:
+                self._span.set_error(exc)
+            self._span.finish()
+            _current_span.reset(self._token)
+        return False
+
+
+"""
+start a leaf span without making it current (for event hooks with separate begin / end callbacks),
+returns None when the trace is not sampled
+"""
+def start_span(name: str, **attrs) -> Span | None:
+    parent = _current_span.get()
+    if parent is None:
+        return None
+    return Span(name, parent.trace_id, parent, attrs)
+
+
+"""
+root span of a trace (http request or xxl-job run), the sampling decision is taken here and the
+span tree is exported when the root ends
+"""
+class start_trace:
+    __slots__ = ("name", "trace_id", "attrs", "_span", "_token")
+
+    def __init__(self, name: str, trace_id=None, **attrs):
+        self.name = name
+        self.trace_id = trace_id
+        self.attrs = attrs
+        self._span = None
+        self._token = None
+
+    def __enter__(self) -> Span | None:
+        if trace_sample_rate <= 0 or random.random() >= trace_sample_rate:
+            return None
+        trace_id = str(self.trace_id or get_trace_id() or uuid.uuid4())
+        self._span = Span(self.name, trace_id, None, self.attrs)
+        self._token = _current_span.set(self._span)
+        return self._span
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._span is not None:
+            if exc is not None:
+                self._span.set_error(exc)
+            self._span.finish()
+            _current_span.reset(self._token)
+            export_spans(self._span.spans)
+        return False
+
+
+"""
+capture the trace state of the caller, to be restored in another thread or event loop
+"""
+def capture_trace_context() -> tuple:
+    return get_trace_id(), _current_span.get()
+
+
+def restore_trace_context(state: tuple):
+    trace_id, current = state
+    if trace_id is not None:
+        set_trace_id(trace_id)
+    _current_span.set(current)
+
+
+"""
+sql comment with the trace id, so the statement can be found in the MySQL slow log
+"""
+def trace_sql_comment() -> str:
+    trace_id = get_trace_id()
+    if trace_id is None:
+        return ""
+    # the id may come from the X-Trace-Id header: the comment is added after the driver escaping,
+    # so only safe characters are kept (a % would break the driver's parameter formatting)
+    trace_id = _UNSAFE_SQL_CHARS.sub("", str(trace_id))[:64]
+    return "/* trace_id=" + trace_id + " */ " if trace_id else ""
+
+
+"""
+aiohttp client trace config: adds the X-Trace-Id header and an http span to outbound calls
+"""
+def get_trace_config() -> aiohttp.TraceConfig:
+    trace_config = aiohttp.TraceConfig()
+
+    async def on_request_start(session, ctx, params):
+        trace_id = get_trace_id()
+        if trace_id is not None:
+            params.headers["X-Trace-Id"] = str(trace_id)
+        ctx.span = start_span(f"HTTP {params.method}", **{"http.host": params.url.host, "http.path": params.url.path})
+
+    async def on_request_end(session, ctx, params):
+        if ctx.span is not None:
+            ctx.span.set_attr("http.status", params.response.status)
+            ctx.span.finish()
+
+    async def on_request_exception(session, ctx, params):
+        if ctx.span is not None:
+            ctx.span.set_error(params.exception)
+            ctx.span.finish()
+
+    trace_config.on_request_start.append(on_request_start)
+    trace_config.on_request_end.append(on_request_end)
+    trace_config.on_request_exception.append(on_request_exception)
+    return trace_config
+
+
+"""
+Background span exporter: batches finished traces and writes them as json lines to a file
+or posts them as OTLP/HTTP json to a collector
+"""
+class SpanExporter:
+
+    def __init__(self, target: str, batch_size: int = 512, flush_interval: float = 1.0, max_queue: int = 10000):
+        self.target = target
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = deque(maxlen=max_queue)
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+        self._thread.start()
+
+    def export(self, spans: list[Span]):
+        with self._cond:
+            self._queue.extend(spans)
+            if len(self._queue) >= self.batch_size:
+                self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._queue and not self._closed:
+                    self._cond.wait(self.flush_interval)
+                batch = list(self._queue)
+                self._queue.clear()
+                closed = self._closed
+            if batch:
+                try:
+                    self._write(batch)
+                except Exception as e:
+                    log.warning(f"export {len(batch)} spans failed: {e}")
+            if closed:
+                return
+
+    def _write(self, batch: list[Span]):
+        if self.target.startswith("file:"):
+            with open(self.target[len("file:"):], "a", encoding="utf-8") as f:
+                f.write("".join(json.dumps(s.to_dict(), ensure_ascii=False, default=str) + "\n" for s in batch))
+        elif self.target.startswith("otlp:"):
+            requests.post(self.target[len("otlp:"):], json=_to_otlp(batch), timeout=10).raise_for_status()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join(timeout=10)
+
+
+def _otlp_id(value: str, length: int) -> str:
+    # otlp ids are hex strings of 16 (trace) / 8 (span) bytes
+    text = str(value).replace("-", "")
+    if len(text) == length and all(c in "0123456789abcdef" for c in text.lower()):
+        return text.lower()
+    if text.isdigit():
+        return format(int(text), "x").zfill(length)[-length:]
+    return hashlib.md5(text.encode("utf-8")).hexdigest()[:length]
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _to_otlp(batch: list[Span]) -> dict:
+    spans = []
+    for s in batch:
+        attrs = {**s.attrs, "trace.id": s.trace_id}
+        item = {
+            "traceId": _otlp_id(s.trace_id, 32),
+            "spanId": s.span_id,
+            "name": s.name,
+            "kind": 2 if s.parent_id is None else 1,
+            "startTimeUnixNano": str(s.start_ns),
+            "endTimeUnixNano": str(s.end_ns),
+            "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in attrs.items()],
+            "status": {"code": 2, "message": s.error} if s.error else {"code": 1},
+        }
+        if s.parent_id:
+            item["parentSpanId"] = s.parent_id
+        spans.append(item)
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": service_name}}]},
+            "scopeSpans": [{"scope": {"name": "app.config.trace_.span"}, "spans": spans}],
+        }]
+    }
+
+
+_exporter: SpanExporter | None = None
+_exporter_lock = threading.Lock()
+
+
+def export_spans(spans: list[Span]):
+    global _exporter
+    if not trace_exporter:
+        return
+    if _exporter is None or _exporter.target != trace_exporter:
+        with _exporter_lock:
+            if _exporter is None or _exporter.target != trace_exporter:
+                if _exporter is not None:
+                    _exporter.close()
+                else:
+                    atexit.register(shutdown_tracing)
+                _exporter = SpanExporter(trace_exporter)
+    _exporter.export(spans)
+
+
+"""
+apply span tracing configuration from nacos
+e.g.
+trace:
+  sample_rate: 0.01
+  exporter: otlp:http://127.0.0.1:4318/v1/traces
+"""
+def apply_trace_config(trace_config: dict | None):
+    global trace_sample_rate, trace_exporter
+    trace_config = trace_config or {}
+    trace_sample_rate = max(0.0, min(1.0, float(trace_config.get("sample_rate", os.getenv("TRACE_SAMPLE_RATE", "0")))))
+    trace_exporter = trace_config.get("exporter", os.getenv("TRACE_EXPORTER", ""))
+
+
+"""
+flush the pending spans, used at process exit
+"""
+def shutdown_tracing():
+    if _exporter is not None:
+        _exporter.close()
@@ -1,9 +1,12 @@
+import time
 import uuid
 
 from fastapi import Request
 from starlette.middleware.base import BaseHTTPMiddleware
 
+from app.common.logger import begin_trace_buffer, end_trace_buffer
 from app.config.trace_.request_context import set_trace_id
+from app.config.trace_.span import start_trace
 
 """
 FastAPI trace related middleware
@@ -17,7 +20,18 @@ class TraceIdMiddleware(BaseHTTPMiddleware):
         # 1. Retrieve traceId (such as X-Trace Id) from the header, generate if not available
         trace_id = request.headers.get("X-Trace-Id") or str(uuid.uuid4())
         set_trace_id(trace_id)
-        # 2. TraceId can be added with a response header, or it can only be used for logging purposes
-        response = await call_next(request)
+        # 2. buffer debug logs of this request, written only if it fails or is slow
+        start = time.perf_counter()
+        failed = True
+        begin_trace_buffer(trace_id)
+        try:
+            with start_trace(f"{request.method} {request.url.path}", trace_id) as root:
+                response = await call_next(request)
+                failed = response.status_code >= 500
+                if root is not None:
+                    root.set_attr("http.status", response.status_code)
+        finally:
+            end_trace_buffer(trace_id, failed, (time.perf_counter() - start) * 1000)
+        # 3. TraceId can be added with a response header, or it can only be used for logging purposes
         response.headers["X-Trace-Id"] = trace_id
         return response
\ No newline at end of file
@@ -1,15 +1,33 @@
 import asyncio
+import atexit
+import importlib
+import inspect
+import multiprocessing as mp
 import os
 import socket
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import asynccontextmanager
+from dataclasses import asdict
 from functools import wraps
+from threading import Event, Lock, Thread
 
 import pyxxl.xxl_client
-from pyxxl import ExecutorConfig, PyxxlRunner
+from pyxxl import ExecutorConfig, JobHandler, PyxxlRunner
 from pyxxl.ctx import g
+from pyxxl.error import JobDuplicateError, XXLClientError
+from pyxxl.logger import DiskLog, new_logger
+from pyxxl.schema import RunData
 
-from app.common.logger import log
+from app.common.const import TaskOverlapPolicy, TaskPool
+from app.common.logger import log, trace_buffer
+from app.config.db.query_deadline import get_query_scope, query_timeout
+from app.config.loop_monitor import start_loop_monitor
+from app.config.xxl_job_metrics import mount_metrics_routes, record_admin_request, record_task_run
 from app.config.nacos_config import get_config
 from app.config.trace_.request_context import set_trace_id
+from app.config.trace_.span import start_trace
 # from app.common.utils.wechat_msg_util import send_markdown_template_exception_message
 # from app.common.const import WechatRobotEnum
 
@@ -23,6 +41,10 @@ xxl_log_path = os.getenv("XXL_LOG_PATH", f"{BASE_DIR}/xxl_log")
 
 _executor = None
 
+# handlers registered by traced_executor, the runner is built on first use: the task modules imported
+# by the process pool workers register here without loading the executor config from nacos
+_handler = JobHandler()
+
 """
 get the ip address of the local executor
 """
@@ -61,10 +83,32 @@ def _load_xxl_config() -> ExecutorConfig:
     )
     return executor_config
 
+"""
+executor runner, the event loop stall monitor starts once with the executor app (not per trigger),
+the executor app also serves the run history on /runs
+"""
+class _TracedRunner(PyxxlRunner):
+
+    def __init__(self, config: ExecutorConfig, handler: JobHandler, monitor_config: dict):
+        super().__init__(config, handler=handler)
+        self.monitor_config = monitor_config
+
+    def create_server_app(self):
+        app = super().create_server_app()
+        # /runs next to the /metrics of pyxxl
+        mount_metrics_routes(app)
+
+        async def on_startup(app):
+            start_loop_monitor(self.monitor_config)
+
+        app.on_startup.append(on_startup)
+        return app
+
+
 def _load_executor():
     global _executor
     if _executor is None:
-        _executor = PyxxlRunner(_load_xxl_config())
+        _executor = _TracedRunner(_load_xxl_config(), _handler, get_config().get("loop_monitor") or {})
     return _executor
 
 """
@@ -76,28 +120,184 @@ def get_executor() -> PyxxlRunner:
         _load_executor()
     return _executor
 
+"""
+Per handler concurrency limiter, applies the overlap policy when max concurrent runs is reached.
+
+The limit covers every jobId bound to the handler on this executor: pyxxl itself runs one trigger
+of a jobId at a time (the executorBlockStrategy of the job decides about its next trigger), the
+limiter decides about the triggers of the other jobIds of the handler, e.g. one handler scheduled
+by several jobs with different executorParams. An overlap policy without max_concurrency means the
+handler never runs twice at the same time.
+"""
+class _TaskLimiter:
+
+    def __init__(self, name: str, max_concurrency: int | None, overlap: TaskOverlapPolicy | None):
+        if overlap is not None and not max_concurrency:
+            max_concurrency = 1
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.overlap = overlap or TaskOverlapPolicy.BLOCK
+        self._semaphore = asyncio.Semaphore(max_concurrency) if max_concurrency else None
+        # logId -> asyncio task of the running trigger, in start order
+        self.running: dict[int, asyncio.Task] = {}
+
+    @asynccontextmanager
+    async def slot(self, log_id: int):
+        if self._semaphore is not None:
+            if self._semaphore.locked():
+                if self.overlap == TaskOverlapPolicy.DISCARD:
+                    raise JobDuplicateError(
+                        f"task {self.name} reached max concurrent runs {self.max_concurrency}, logId {log_id} discarded")
+                if self.overlap == TaskOverlapPolicy.REPLACE and self.running:
+                    earliest_log_id, earliest_task = next(iter(self.running.items()))
+                    log.warning(f"[XXL-JOB] task {self.name} logId {earliest_log_id} replaced by logId {log_id}")
+                    earliest_task.cancel()
+            await self._semaphore.acquire()
+        self.running[log_id] = asyncio.current_task()
+        try:
+            yield
+        finally:
+            self.running.pop(log_id, None)
+            if self._semaphore is not None:
+                self._semaphore.release()
+
+
+_process_pool: ProcessPoolExecutor | None = None
+_process_pool_lock = Lock()
+# cancel events shared with the process pool workers
+_process_manager = None
+
+"""
+process pool for cpu-bound sync tasks, workers are spawned (not forked) to stay clear of
+the threads of the parent process
+"""
+def _get_process_pool() -> ProcessPoolExecutor:
+    global _process_pool, _process_manager
+    if _process_pool is None:
+        with _process_pool_lock:
+            if _process_pool is None:
+                context = mp.get_context("spawn")
+                if _process_manager is None:
+                    _process_manager = context.Manager()
+                    atexit.register(_process_manager.shutdown)
+                max_workers = get_config()['xxl-job'].get('process_workers') or os.cpu_count()
+                _process_pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=context)
+                atexit.register(_process_pool.shutdown, wait=False, cancel_futures=True)
+    return _process_pool
+
+
+"""
+entry of a task running in the process pool: restore trace id, run data and task log, then call the task
+with the query deadline of the run (wall clock, the monotonic clock is per process), the manager event
+is set by the parent when the run is killed: it is the g.cancel_event of the task and kills its queries
+"""
+def _process_task_entry(module_name: str, qualname: str, run_data: dict, deadline: float | None, cancel_event,
+                        args: tuple, kwargs: dict):
+    data = RunData.from_dict(run_data)
+    set_trace_id(data.logId)
+    g.set_xxl_run_data(data)
+    g.set_cancel_event(cancel_event)
+
+    target = importlib.import_module(module_name)
+    for attr in qualname.split("."):
+        target = getattr(target, attr)
+    # the module attribute is the registered wrapper, call the original function
+    func = inspect.unwrap(target)
+
+    timeout = max(deadline - time.time(), 0.001) if deadline is not None else None
+    finished = Event()
+    with new_logger(DiskLog(xxl_log_path), data.logId):
+        with trace_buffer(data.logId), query_timeout(timeout, cancellable=True) as scope:
+
+            def watch_cancel():
+                while not finished.is_set():
+                    if cancel_event.wait(1):
+                        scope.cancel(f"xxl-job logId {data.logId} killed")
+                        return
+
+            Thread(target=watch_cancel, name=f"xxl-cancel-{data.logId}", daemon=True).start()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                finished.set()
+
+
+async def _run_in_process(func, data: RunData, args: tuple, kwargs: dict):
+    global _process_pool
+    loop = asyncio.get_running_loop()
+    pool = _get_process_pool()
+    cancel_event = _process_manager.Event()
+    scope = get_query_scope()
+    remaining = scope.remaining() if scope is not None else None
+    deadline = time.time() + remaining if remaining is not None else None
+    future = pool.submit(
+        _process_task_entry, func.__module__, func.__qualname__, asdict(data), deadline, cancel_event, args, kwargs)
+    try:
+        return await asyncio.wrap_future(future, loop=loop)
+    except asyncio.CancelledError:
+        if not future.cancel():
+            # a running worker can not be interrupted: its queries are killed, the task sees g.cancel_event
+            cancel_event.set()
+            log.warning(f"[XXL-JOB] logId {data.logId} cancelled, the process worker runs until the task returns")
+        raise
+    except BrokenProcessPool:
+        # a worker died (e.g. OOM killed), recreate the pool for the next trigger
+        with _process_pool_lock:
+            _process_pool = None
+        raise
+
+
+async def _run_in_thread(func, args: tuple, kwargs: dict):
+    # same cancel signal as pyxxl gives to sync tasks
+    event = Event()
+    g.set_cancel_event(event)
+    try:
+        return await asyncio.to_thread(func, *args, **kwargs)
+    except asyncio.CancelledError:
+        event.set()
+        raise
+
+
 """
 xxl-job automatic bind trace_id executor
+
+:param name: 任务名称（xxl-job JobHandler）
+:param max_concurrency: 本执行器上该任务（绑定该任务的所有 jobId）的最大并发运行数，None 表示不限制
+                        （同一 jobId 由 pyxxl 串行执行，按任务的阻塞处理策略处理新触发）
+:param overlap: 达到最大并发时新触发的处理策略（BLOCK / DISCARD / REPLACE），未设置 max_concurrency 时表示同一时间只运行一次
+:param pool: 同步任务的执行池，CPU 密集型任务使用进程池
 """
-def traced_executor(name):
+def traced_executor(name, max_concurrency: int = None, overlap: TaskOverlapPolicy = None,
+                    pool: TaskPool = TaskPool.THREAD):
 
     def decorator(func):
-        @wraps(func)
-        def sync_wrapper(*args, **kwargs):
-            trace_id = g.xxl_run_data.logId
-            set_trace_id(trace_id)
-            return func(*args, **kwargs)
+        is_async = asyncio.iscoroutinefunction(func)
+        if is_async and pool == TaskPool.PROCESS:
+            raise ValueError(f"task {name}: async tasks can not run in the process pool")
+        limiter = _TaskLimiter(name, max_concurrency, overlap)
 
         @wraps(func)
         async def async_wrapper(*args, **kwargs):
-            trace_id = g.xxl_run_data.logId
+            data = g.xxl_run_data
+            trace_id = data.logId
             set_trace_id(trace_id)
-            return await func(*args, **kwargs)
-
-        wrapped_func = async_wrapper if asyncio.iscoroutinefunction(func) else sync_wrapper
+            with record_task_run(name, data) as run, start_trace(f"xxl-job {name}", trace_id, jobId=data.jobId):
+                async with limiter.slot(data.logId):
+                    run.started()
+                    # queries of the run get the executor timeout as deadline and are killed with the run
+                    with trace_buffer(trace_id), query_timeout(data.executorTimeout or None, cancellable=True) as scope:
+                        try:
+                            if is_async:
+                                return await func(*args, **kwargs)
+                            if pool == TaskPool.PROCESS:
+                                return await _run_in_process(func, data, args, kwargs)
+                            return await _run_in_thread(func, args, kwargs)
+                        except asyncio.CancelledError:
+                            scope.cancel(f"xxl-job {name} logId {data.logId} killed")
+                            raise
 
-        # register to pyxxl
-        return _executor.register(name=name)(wrapped_func)
+        # register to pyxxl, sync tasks are also registered as a coroutine so the limiter runs on the loop
+        return _handler.register(name=name)(async_wrapper)
     return decorator
 
 
@@ -105,19 +305,25 @@ def traced_executor(name):
 # save original method
 _real_post = pyxxl.xxl_client.XXL._post
 
-# expand the original method and add alarms
-async def patched_post(self, *args, **kwargs):
+# expand the original method, add alarms and admin request metrics
+async def patched_post(self, path, *args, **kwargs):
+    start = time.perf_counter()
     try:
-        return await _real_post(self, *args, **kwargs)
+        result = await _real_post(self, path, *args, **kwargs)
+        record_admin_request(path, "ok", time.perf_counter() - start)
+        return result
     except Exception as e:
-        log.exception(f"[XXL-JOB] Request Admin Error: {str(e)}")
+        record_admin_request(path, "error", time.perf_counter() - start)
+        log.exception(f"[XXL-JOB] Request Admin Error: path={path}, {str(e)}")
         # send message to enterprise wechat (if necessary you can open it)
         # send_markdown_template_exception_message(WechatRobotEnum.ALGORITHM_DEFAULT, ["[XXL-JOB] Request Admin Error"], e)
+        # pyxxl reports a failed registry itself (registry returns False) but only catches XXLClientError,
+        # anything else (aiohttp timeout / connection error) would end the heartbeat loop for good.
+        # a failed callback or registryRemove must not break the task run or the graceful close
+        if path == "registry":
+            if isinstance(e, XXLClientError):
+                raise
+            raise XXLClientError(f"registry request failed: {e!r}") from e
 
 # Patch (replacement method)
 pyxxl.xxl_client.XXL._post = patched_post
-
-"""
-Global initialization
-"""
-_load_executor()
@@ -0,0 +1,125 @@
+import asyncio
+import json
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+from aiohttp import web
+from prometheus_client import Counter, Gauge, Histogram
+from pyxxl.error import JobDuplicateError
+from pyxxl.schema import RunData
+
+# number of run summaries kept per task
+RUN_HISTORY_SIZE = 50
+
+_DURATION_BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600, 7200, float("inf"))
+_DELAY_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, float("inf"))
+
+TASK_QUEUE_DELAY = Histogram("xxl_task_queue_delay_seconds", "xxl-job trigger to task start delay",
+                             ["task"], buckets=_DELAY_BUCKETS)
+TASK_DURATION = Histogram("xxl_task_duration_seconds", "xxl-job task run duration",
+                          ["task", "status"], buckets=_DURATION_BUCKETS)
+TASK_RUNS = Counter("xxl_task_runs", "xxl-job task runs by final status", ["task", "status"])
+TASK_RUNNING = Gauge("xxl_task_running", "xxl-job task runs in progress", ["task"])
+ADMIN_REQUEST = Histogram("xxl_admin_request_seconds", "executor to xxl-job admin request latency, retries included",
+                          ["path", "status"], buckets=_DELAY_BUCKETS)
+
+_history: dict[str, deque] = defaultdict(lambda: deque(maxlen=RUN_HISTORY_SIZE))
+_history_lock = threading.Lock()
+
+
+"""
+Metrics of one task run, started() marks the moment the task body begins
+"""
+class TaskRun:
+
+    def __init__(self, name: str, data: RunData):
+        self.name = name
+        self.data = data
+        self.start_time = None
+        self.queue_delay = None
+
+    def started(self):
+        self.start_time = time.time()
+        if self.data.logDateTime:
+            # logDateTime is the trigger time of xxl-job admin in milliseconds
+            self.queue_delay = max(0.0, self.start_time - self.data.logDateTime / 1000)
+            TASK_QUEUE_DELAY.labels(self.name).observe(self.queue_delay)
+        TASK_RUNNING.labels(self.name).inc()
+
+
+"""
+record queue delay, duration, final status and run history of a task run
+"""
+@contextmanager
+def record_task_run(name: str, data: RunData):
+    run = TaskRun(name, data)
+    status, error = "success", None
+    try:
+        yield run
+    except JobDuplicateError as e:
+        status, error = "discarded", str(e)
+        raise
+    except asyncio.CancelledError:
+        status = "cancelled"
+        raise
+    except Exception as e:
+        status, error = "failed", repr(e)
+        raise
+    finally:
+        end_time = time.time()
+        duration = end_time - run.start_time if run.start_time else 0.0
+        if run.start_time:
+            TASK_RUNNING.labels(name).dec()
+            TASK_DURATION.labels(name, status).observe(duration)
+        TASK_RUNS.labels(name, status).inc()
+        with _history_lock:
+            _history[name].append({
+                "logId": data.logId,
+                "jobId": data.jobId,
+                "trigger_time": data.logDateTime,
+                "start_time": run.start_time,
+                "end_time": end_time,
+                "queue_delay": run.queue_delay,
+                "duration": duration,
+                "status": status,
+                "error": error,
+            })
+
+
+"""
+record one executor to admin request (registry, registryRemove, callback)
+"""
+def record_admin_request(path: str, status: str, seconds: float):
+    ADMIN_REQUEST.labels(path, status).observe(seconds)
+
+
+"""
+get the last run summaries, of one task or of all tasks
+"""
+def get_run_history(name: str = None) -> dict[str, list[dict]]:
+    with _history_lock:
+        if name is not None:
+            return {name: list(_history.get(name, ()))}
+        return {task: list(runs) for task, runs in _history.items()}
+
+
+routes = web.RouteTableDef()
+
+
+"""
+last run summaries as json, ?task= limits them to one task
+"""
+@routes.get("/runs")
+async def runs(request: web.Request) -> web.Response:
+    return web.json_response(get_run_history(request.query.get("task")),
+                             dumps=lambda obj: json.dumps(obj, ensure_ascii=False, default=str))
+
+
+"""
+add /runs to the executor server, the collectors above are in the default prometheus registry
+which pyxxl already exposes on /metrics of the executor port
+"""
+def mount_metrics_routes(app: web.Application):
+    app.add_routes(routes)
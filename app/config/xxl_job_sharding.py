@@ -0,0 +1,146 @@
+import json
+from typing import NamedTuple
+
+import pandas as pd
+from pyxxl.ctx import g
+
+from app.common.const import ShardStrategy
+from app.common.logger import log
+from app.config.db.db_mysql import query_mysql_to_df, query_mysql_to_dict
+
+
+"""
+shard of the current executor node in a broadcast xxl-job trigger
+"""
+class Shard(NamedTuple):
+    index: int
+    total: int
+
+
+"""
+read the shard parameters from the pyxxl run context,
+a non broadcast trigger (or a call outside a task) is a single shard 0/1
+"""
+def get_shard() -> Shard:
+    data = g.try_get_run_data()
+    if data is None or not data.broadcastTotal:
+        return Shard(0, 1)
+    return Shard(data.broadcastIndex or 0, data.broadcastTotal)
+
+
+"""
+split the inclusive id range [min_id, max_id] into total contiguous ranges of almost the same size
+"""
+def split_id_range(min_id: int, max_id: int, total: int) -> list[tuple[int, int]]:
+    if total <= 0:
+        raise ValueError("shard total must be positive")
+    size = max_id - min_id + 1
+    ranges = []
+    start = min_id
+    for index in range(total):
+        # the first (size % total) ranges get one extra id
+        length = size // total + (1 if index < size % total else 0)
+        ranges.append((start, start + length - 1))
+        start += length
+    return ranges
+
+
+"""
+id bounds given by the trigger: executorParams json with max_id (and optionally min_id), the
+broadcast passes the same params to every shard so all shards split the same range
+e.g. executorParams: {"min_id": 1, "max_id": 50000000}
+"""
+def _trigger_id_bounds() -> tuple[int, int | None] | None:
+    data = g.try_get_run_data()
+    if data is None or not data.executorParams:
+        return None
+    try:
+        params = json.loads(data.executorParams)
+    except ValueError:
+        return None
+    if not isinstance(params, dict) or params.get("max_id") is None:
+        return None
+    return int(params.get("min_id") or 0), int(params["max_id"])
+
+
+"""
+get the id range of the local shard, None when the shard has no ids. The first shard has no lower
+bound and the last shard no upper bound (None), so ids outside the split range are still read.
+
+The split range comes from id_bounds, else from the trigger params (see _trigger_id_bounds), else
+from MIN/MAX of the table queried by each shard: the shards query at different moments, so without
+stable bounds the table must not change during the trigger (e.g. inserts move MAX and with it the
+inner boundaries, rows are then read twice or not at all)
+"""
+def local_id_range(db_name: str, tb_name: str, id_column: str = "id", where: str = None,
+                   shard: Shard = None, id_bounds: tuple[int, int] = None) -> tuple[int | None, int | None] | None:
+    shard = shard or get_shard()
+    id_bounds = id_bounds or _trigger_id_bounds()
+    if id_bounds is None:
+        where_sql = f" WHERE {where}" if where else ""
+        row = query_mysql_to_dict(
+            db_name, f"SELECT MIN(`{id_column}`) AS min_id, MAX(`{id_column}`) AS max_id FROM `{tb_name}`{where_sql}")[0]
+        if row["min_id"] is None:
+            return None
+        id_bounds = int(row["min_id"]), int(row["max_id"])
+    start, end = split_id_range(id_bounds[0], id_bounds[1], shard.total)[shard.index]
+    if start > end:
+        # more shards than ids, the last shard still takes the ids above the range
+        return (start, None) if shard.index == shard.total - 1 else None
+    return (None if shard.index == 0 else start), (None if shard.index == shard.total - 1 else end)
+
+
+"""
+sql condition selecting the rows of the local shard by the hash of a key column
+"""
+def hash_shard_condition(key_column: str, shard: Shard = None) -> str:
+    shard = shard or get_shard()
+    if shard.total == 1:
+        return "1 = 1"
+    return f"MOD(CRC32(`{key_column}`), {int(shard.total)}) = {int(shard.index)}"
+
+
+"""
+the partitions (e.g. dates, regions, table names) handled by the local shard, assigned round robin
+"""
+def local_partitions(partitions: list, shard: Shard = None) -> list:
+    shard = shard or get_shard()
+    return sorted(partitions)[shard.index::shard.total]
+
+
+"""
+query only the local slice of a table into a dataframe
+
+e.g.
+from app.config.xxl_job_config import traced_executor as executor
+
+@executor(name="sync_order_task")
+def sync_order_task():
+    df = query_local_shard_to_df("webgis_bi", "order", key_column="id", strategy=ShardStrategy.RANGE)
+"""
+def query_local_shard_to_df(
+        db_name: str,
+        tb_name: str,
+        key_column: str = "id",
+        strategy: ShardStrategy = ShardStrategy.RANGE,
+        columns: str = "*",
+        where: str = None,
+        id_bounds: tuple[int, int] = None
+) -> pd.DataFrame:
+    shard = get_shard()
+    conditions = [f"({where})"] if where else []
+    if strategy == ShardStrategy.RANGE:
+        id_range = local_id_range(db_name, tb_name, key_column, where, shard, id_bounds)
+        if id_range is None:
+            log.info(f"shard {shard.index}/{shard.total} of {tb_name} is empty")
+            return pd.DataFrame()
+        if id_range[0] is not None:
+            conditions.append(f"`{key_column}` >= {int(id_range[0])}")
+        if id_range[1] is not None:
+            conditions.append(f"`{key_column}` <= {int(id_range[1])}")
+    else:
+        conditions.append(hash_shard_condition(key_column, shard))
+
+    sql = f"SELECT {columns} FROM `{tb_name}` WHERE {' AND '.join(conditions) or '1 = 1'}"
+    log.info(f"shard {shard.index}/{shard.total} query: {sql}")
+    return query_mysql_to_df(db_name, sql)
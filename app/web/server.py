@@ -1,8 +1,11 @@
+from functools import partial
+
 import uvicorn
 from fastapi import FastAPI, Request
 from fastapi.responses import JSONResponse
 
 from app.common.logger import log
+from app.config.loop_monitor import start_loop_monitor
 from app.config.nacos_config import get_config
 from app.config.trace_.trace_id_config import TraceIdMiddleware
 from app.nacos_.controller import router as nacos_router
@@ -22,6 +25,9 @@ def create_app():
     # add trace_id middleware
     app.add_middleware(TraceIdMiddleware)
 
+    # log the stack and trace id of requests that block the event loop
+    app.add_event_handler("startup", partial(start_loop_monitor, config.get("loop_monitor") or {}))
+
     # register routes (Routers for different business modules)
     app.include_router(nacos_router)
     app.include_router(test_router)
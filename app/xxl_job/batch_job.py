@@ -0,0 +1,282 @@
+import contextvars
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+from typing import Callable
+
+import pandas as pd
+from pyxxl.ctx import g
+
+from app.common.logger import log
+from app.config.db.db_mysql import execute_sql, insert_mysql, query_mysql_to_df, query_mysql_to_dict, update_mysql
+
+# progress table of chunked batch jobs
+PROGRESS_TABLE = "xxl_batch_progress"
+
+# lower bound of the first chunk (keyset pagination on a BIGINT key)
+_MIN_KEY = -(2 ** 63)
+# start_key of the marker row of a completed run (no chunk starts after the largest BIGINT)
+_COMPLETED_KEY = 2 ** 63 - 1
+
+_CREATE_PROGRESS_TABLE = f"""
+CREATE TABLE IF NOT EXISTS `{PROGRESS_TABLE}` (
+    `job_name` VARCHAR(128) NOT NULL COMMENT 'batch job name',
+    `run_key` VARCHAR(128) NOT NULL COMMENT 'logical run, reruns with the same key resume',
+    `start_key` BIGINT NOT NULL COMMENT 'exclusive lower bound of the chunk',
+    `end_key` BIGINT NOT NULL COMMENT 'inclusive upper bound of the chunk',
+    `row_count` INT NOT NULL,
+    `finished_at` DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (`job_name`, `run_key`, `start_key`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='checkpoints of chunked xxl-job batch jobs'
+"""
+
+"""
+write progress to the xxl-job task log (visible in xxl-job admin) and to the application log
+"""
+def _task_log(msg: str):
+    log.info(msg)
+    try:
+        g.logger.info(msg)
+    except LookupError:
+        pass
+
+
+def _cancel_event():
+    try:
+        return g.cancel_event
+    except LookupError:
+        return None
+
+
+"""
+Resumable chunked batch job: walks a source table with keyset pagination, processes the chunks
+in a bounded worker pool and stores a checkpoint per finished chunk, a rerun with the same
+run_key skips the finished chunks. A run that finishes writes a completed marker, a later run
+with the same run_key (by default the same day) processes nothing and logs it, call reset() or
+pass another run_key to process the table again.
+
+process_chunk must be idempotent: the checkpoint is written after process_chunk returns, a crash
+or a failed checkpoint write in between processes the chunk again on the rerun. Write with upserts
+or delete and insert by key (e.g. df_to_db), not plain inserts or incremented counters.
+The chunks run with the context of the task (trace id, xxl-job logger, query deadline), a kill
+from xxl-job admin stops reading, the chunks already running finish and are checkpointed.
+
+e.g.
+@executor(name="sync_order_task")
+def sync_order_task():
+    def process(df: pd.DataFrame) -> None:
+        df_to_db(transform(df), "webgis_bi", "order_stat", ["order_id"])
+
+    return ChunkedBatchJob("sync_order_task", "webgis_bi", "order", process, chunk_size=5000).run()
+"""
+class ChunkedBatchJob:
+
+    def __init__(
+            self,
+            job_name: str,
+            db_name: str,
+            tb_name: str,
+            process_chunk: Callable[[pd.DataFrame], object],
+            key_column: str = "id",
+            columns: str = "*",
+            where: str = None,
+            chunk_size: int = 5000,
+            workers: int = 4,
+            run_key: str = None,
+            progress_db: str = None,
+            estimate_total: bool = True
+    ):
+        """
+        :param job_name: 批处理任务名称，与run_key一起确定断点
+        :param db_name: 源表所在数据库
+        :param tb_name: 源表名称
+        :param process_chunk: 每个分块的处理函数，参数为分块DataFrame
+        :param key_column: 分页键（整型、唯一、有索引，通常为主键）
+        :param columns: 查询列，必须包含分页键
+        :param where: 额外过滤条件
+        :param chunk_size: 每个分块的行数
+        :param workers: 处理分块的最大并发数
+        :param run_key: 逻辑运行标识，默认当天日期，同一标识重跑时断点续跑，已完成的标识重跑时不再处理
+        :param progress_db: 进度表所在数据库，默认与源表相同
+        :param estimate_total: 是否统计剩余行数用于估算完成时间
+        """
+        self.job_name = job_name
+        self.db_name = db_name
+        self.tb_name = tb_name
+        self.process_chunk = process_chunk
+        self.key_column = key_column
+        self.columns = columns
+        self.where = where
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.run_key = run_key or datetime.now().strftime("%Y-%m-%d")
+        self.progress_db = progress_db or db_name
+        self.estimate_total = estimate_total
+
+        self._rows_done = 0
+        self._chunks_done = 0
+        self._total_rows = None
+        self._start_time = None
+
+    def reset(self):
+        """drop the checkpoints of this run, the next run starts from the beginning"""
+        update_mysql(self.progress_db,
+                     f"DELETE FROM `{PROGRESS_TABLE}` WHERE job_name = :job_name AND run_key = :run_key",
+                     {"job_name": self.job_name, "run_key": self.run_key})
+
+    def _load_checkpoints(self) -> dict[int, tuple[int, int]]:
+        execute_sql(self.progress_db, _CREATE_PROGRESS_TABLE)
+        rows = query_mysql_to_dict(
+            self.progress_db,
+            f"SELECT start_key, end_key, row_count FROM `{PROGRESS_TABLE}` "
+            f"WHERE job_name = :job_name AND run_key = :run_key",
+            {"job_name": self.job_name, "run_key": self.run_key})
+        return {int(row["start_key"]): (int(row["end_key"]), int(row["row_count"])) for row in rows}
+
+    def _save_completed(self):
+        self._save_checkpoint(_COMPLETED_KEY, _COMPLETED_KEY, self._rows_done)
+
+    def _save_checkpoint(self, start_key: int, end_key: int, row_count: int):
+        insert_mysql(self.progress_db,
+                     f"INSERT INTO `{PROGRESS_TABLE}` (job_name, run_key, start_key, end_key, row_count) "
+                     f"VALUES (:job_name, :run_key, :start_key, :end_key, :row_count) "
+                     f"ON DUPLICATE KEY UPDATE end_key = VALUES(end_key), row_count = VALUES(row_count), "
+                     f"finished_at = CURRENT_TIMESTAMP",
+                     {"job_name": self.job_name, "run_key": self.run_key, "start_key": start_key,
+                      "end_key": end_key, "row_count": row_count})
+
+    def _where_sql(self, lower_key: int) -> str:
+        conditions = [f"`{self.key_column}` > {int(lower_key)}"]
+        if self.where:
+            conditions.append(f"({self.where})")
+        return " AND ".join(conditions)
+
+    def _read_chunk(self, lower_key: int) -> pd.DataFrame:
+        sql = (f"SELECT {self.columns} FROM `{self.tb_name}` WHERE {self._where_sql(lower_key)} "
+               f"ORDER BY `{self.key_column}` LIMIT {int(self.chunk_size)}")
+        return query_mysql_to_df(self.db_name, sql)
+
+    def _count_remaining(self, lower_key: int, skipped: dict[int, tuple[int, int]]) -> int:
+        rows = query_mysql_to_dict(
+            self.db_name, f"SELECT COUNT(*) AS cnt FROM `{self.tb_name}` WHERE {self._where_sql(lower_key)}")
+        # finished chunks beyond the resume point are not read again
+        return int(rows[0]["cnt"]) - sum(row_count for start, (_, row_count) in skipped.items() if start >= lower_key)
+
+    def _run_chunk(self, lower_key: int, df: pd.DataFrame) -> tuple[int, int]:
+        self.process_chunk(df)
+        end_key = int(df[self.key_column].iloc[-1])
+        self._save_checkpoint(lower_key, end_key, len(df))
+        return end_key, len(df)
+
+    def _report(self):
+        elapsed = time.perf_counter() - self._start_time
+        rate = self._rows_done / elapsed if elapsed > 0 else 0.0
+        msg = (f"[BATCH] {self.job_name} run_key={self.run_key} chunks={self._chunks_done} "
+               f"rows={self._rows_done} rate={rate:.1f} rows/s")
+        if self._total_rows:
+            remaining = max(0, self._total_rows - self._rows_done)
+            eta = remaining / rate if rate > 0 else float("inf")
+            msg += f" progress={self._rows_done * 100 / self._total_rows:.1f}% eta={eta:.0f}s"
+        _task_log(msg)
+
+    def run(self) -> dict:
+        """run (or resume) the batch job, returns a summary of this run"""
+        self._start_time = time.perf_counter()
+        checkpoints = self._load_checkpoints()
+        completed = checkpoints.pop(_COMPLETED_KEY, None)
+        if completed is not None:
+            _task_log(f"[BATCH] {self.job_name} run_key={self.run_key} already completed "
+                      f"({sum(row_count for _, row_count in checkpoints.values())} rows), nothing to process, "
+                      f"reset() or another run_key processes the table again")
+            return {
+                "job_name": self.job_name,
+                "run_key": self.run_key,
+                "chunks": 0,
+                "rows": 0,
+                "seconds": round(time.perf_counter() - self._start_time, 3),
+                "cancelled": False,
+                "already_completed": True,
+            }
+        lower_key = _MIN_KEY
+        # skip the leading chunks that are already committed
+        while lower_key in checkpoints:
+            lower_key = checkpoints[lower_key][0]
+        resumed_from = lower_key
+
+        if self.estimate_total:
+            self._total_rows = self._count_remaining(lower_key, checkpoints)
+        _task_log(f"[BATCH] {self.job_name} run_key={self.run_key} start, finished chunks={len(checkpoints)}, "
+                  f"resume after key {resumed_from if resumed_from != _MIN_KEY else '-'}, "
+                  f"rows to process={self._total_rows}")
+
+        error = None
+        cancelled = False
+        cancel_event = _cancel_event()
+        in_flight = set()
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=f"batch-{self.job_name}") as pool:
+            try:
+                while True:
+                    if cancel_event is not None and cancel_event.is_set():
+                        cancelled = True
+                        break
+                    # chunks committed by an earlier run (finished out of order) are not read again
+                    while lower_key in checkpoints:
+                        lower_key = checkpoints[lower_key][0]
+                    # bounded number of chunks in memory: wait for a worker before reading the next chunk
+                    while len(in_flight) >= self.workers * 2:
+                        done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                        self._collect(done)
+                    df = self._read_chunk(lower_key)
+                    if df.empty:
+                        break
+                    # a copy per chunk: the worker threads see the trace id, span and xxl-job context of the task
+                    in_flight.add(pool.submit(contextvars.copy_context().run, self._run_chunk, lower_key, df))
+                    lower_key = int(df[self.key_column].iloc[-1])
+                    if len(df) < self.chunk_size:
+                        break
+            except Exception as e:
+                error = e
+            if cancelled:
+                # chunks not started yet are not checkpointed, the rerun reads them again
+                in_flight = {future for future in in_flight if not future.cancel()}
+            done, _ = wait(in_flight)
+            try:
+                self._collect(done)
+            except Exception as e:
+                error = error or e
+
+        if error is not None:
+            _task_log(f"[BATCH] {self.job_name} run_key={self.run_key} failed after {self._rows_done} rows, "
+                      f"rerun to resume: {error}")
+            raise error
+
+        self._report()
+        if cancelled:
+            _task_log(f"[BATCH] {self.job_name} run_key={self.run_key} cancelled after {self._rows_done} rows, "
+                      f"rerun to resume")
+        else:
+            self._save_completed()
+        return {
+            "job_name": self.job_name,
+            "run_key": self.run_key,
+            "chunks": self._chunks_done,
+            "rows": self._rows_done,
+            "seconds": round(time.perf_counter() - self._start_time, 3),
+            "cancelled": cancelled,
+            "already_completed": False,
+        }
+
+    def _collect(self, done):
+        first_error = None
+        for future in done:
+            try:
+                _, row_count = future.result()
+            except Exception as e:
+                log.exception(f"[BATCH] {self.job_name} chunk failed: {e}")
+                first_error = first_error or e
+                continue
+            self._rows_done += row_count
+            self._chunks_done += 1
+            self._report()
+        if first_error is not None:
+            raise first_error
@@ -22,7 +22,7 @@ def refresh_nacos_config_task():
 
         nacos_client.refresh()
 
-        log.info(f"[XXL-JOB] process refresh nacos result:{json.dumps(nacos_client.get_yaml_config())}")
+        log.opt(lazy=True).info("[XXL-JOB] process refresh nacos result:{}", lambda: json.dumps(nacos_client.get_yaml_config()))
 
         end_msg = "[XXL-JOB] process refresh nacos finish..."
         g.logger.info(end_msg)
@@ -0,0 +1,145 @@
+"""
+xxl-job executor throughput benchmark against the local admin simulator
+
+the executor runs in process with the handlers registered by traced_executor (benchmark tasks
+below, plus the project tasks with --load-tasks), the admin url points at the simulator
+
+usage:
+    python -m benchmarks.executor_bench --handler bench_sleep --params 0.05 --rate 200 --duration 10 --jobs 50
+    python -m benchmarks.executor_bench --handler bench_noop --rate 100 --admin-delay-ms 500 --http-timeout 1
+    python -m benchmarks.executor_bench --handler bench_noop --admin-fail-rate 0.2 --http-retry-times 3
+"""
+import argparse
+import asyncio
+import time
+
+from aiohttp import web
+from pyxxl import ExecutorConfig, PyxxlRunner
+from pyxxl.ctx import g
+
+from app.config import xxl_job_config
+from app.config.xxl_job_config import traced_executor, xxl_executor_log_path, xxl_log_path
+from app.config.xxl_job_metrics import get_run_history
+from benchmarks.xxl_admin_sim import API_PATH, XxlAdminSimulator
+
+APP_NAME = "pyxxl-bench"
+
+
+@traced_executor(name="bench_noop")
+async def bench_noop():
+    return "ok"
+
+
+@traced_executor(name="bench_sleep")
+async def bench_sleep():
+    await asyncio.sleep(float(g.xxl_run_data.executorParams or 0.05))
+    return "ok"
+
+
+@traced_executor(name="bench_sync_sleep")
+def bench_sync_sleep():
+    time.sleep(float(g.xxl_run_data.executorParams or 0.05))
+    return "ok"
+
+
+def _percentiles(values: list[float]) -> str:
+    if not values:
+        return "-"
+    values = sorted(values)
+
+    def pick(p):
+        return values[min(len(values) - 1, int(len(values) * p))] * 1000
+
+    return f"p50={pick(0.5):.1f}ms p95={pick(0.95):.1f}ms p99={pick(0.99):.1f}ms max={values[-1] * 1000:.1f}ms"
+
+
+async def _main(args):
+    if args.load_tasks:
+        from app.xxl_job.scheduler_server import load_tasks
+        load_tasks()
+
+    simulator = XxlAdminSimulator(args.access_token, args.admin_delay_ms, args.admin_fail_rate, args.http_error)
+    await simulator.start("127.0.0.1", args.admin_port)
+
+    config = ExecutorConfig(
+        xxl_admin_baseurl=f"http://127.0.0.1:{args.admin_port}{API_PATH}",
+        executor_app_name=APP_NAME,
+        executor_listen_host="127.0.0.1",
+        executor_listen_port=args.executor_port,
+        access_token=args.access_token,
+        executor_log_path=xxl_executor_log_path,
+        log_local_dir=xxl_log_path,
+        graceful_close=True,
+        max_workers=args.max_workers,
+        task_queue_length=args.task_queue_length,
+        http_retry_times=args.http_retry_times,
+        http_retry_duration=args.http_retry_duration,
+        http_timeout=args.http_timeout,
+        dotenv_try=False,
+    )
+    # the handlers registered by traced_executor with the local config, get_executor() would load the nacos config
+    runner = web.AppRunner(PyxxlRunner(config, handler=xxl_job_config._handler).create_server_app(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", args.executor_port).start()
+
+    try:
+        executor_url = (await simulator.wait_registered(APP_NAME))[0]
+        start = time.time()
+        await simulator.fire(executor_url, args.handler, args.rate, args.duration, args.jobs, args.params)
+        fired = time.time()
+        await simulator.wait_callbacks(timeout=args.drain_timeout)
+        end = time.time()
+    finally:
+        await runner.cleanup()
+        await simulator.stop()
+
+    triggers = simulator.triggers
+    history = {run["logId"]: run for run in get_run_history(args.handler)[args.handler]}
+    accepted = [t for t in triggers.values() if t.get("run_code") == 200]
+    rejected = [t for t in triggers.values() if t.get("run_code") != 200]
+    called_back = [t for t in accepted if "callback_time" in t]
+    succeeded = [t for t in called_back if t["handle_code"] == 200]
+    last_callback = max((t["callback_time"] for t in called_back), default=end)
+
+    accept_latency = [t["accept_time"] - t["trigger_time"] for t in triggers.values() if "accept_time" in t]
+    start_latency = [history[log_id]["queue_delay"] for log_id in triggers
+                     if log_id in history and history[log_id]["queue_delay"] is not None]
+    callback_latency = [t["callback_time"] - history[log_id]["end_time"] for log_id, t in triggers.items()
+                        if "callback_time" in t and log_id in history]
+    end_to_end = [t["callback_time"] - t["trigger_time"] for t in called_back]
+
+    print(f"handler={args.handler} rate={args.rate}/s duration={args.duration}s jobs={args.jobs} "
+          f"admin delay={args.admin_delay_ms}ms fail rate={args.admin_fail_rate}")
+    print(f"triggers fired      {len(triggers)} in {fired - start:.2f}s")
+    print(f"accepted / rejected {len(accepted)} / {len(rejected)}")
+    print(f"callbacks received  {len(called_back)} (success {len(succeeded)}), "
+          f"missing {len(accepted) - len(called_back)}")
+    print(f"throughput          {len(called_back) / max(last_callback - start, 1e-9):.1f} tasks/s")
+    print(f"/run accept         {_percentiles(accept_latency)}")
+    print(f"trigger -> start    {_percentiles(start_latency)}")
+    print(f"task end -> callback {_percentiles(callback_latency)}")
+    print(f"trigger -> callback {_percentiles(end_to_end)}")
+    print(f"admin requests      {simulator.admin_requests}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--handler", default="bench_sleep")
+    parser.add_argument("--params", default=None, help="executorParams, sleep seconds of the bench tasks")
+    parser.add_argument("--rate", type=float, default=50, help="triggers per second")
+    parser.add_argument("--duration", type=float, default=10, help="seconds")
+    parser.add_argument("--jobs", type=int, default=10, help="distinct jobIds, pyxxl runs one trigger per jobId at a time")
+    parser.add_argument("--load-tasks", action="store_true", help="also load the tasks of app.xxl_job.tasks")
+    parser.add_argument("--admin-port", type=int, default=18080)
+    parser.add_argument("--executor-port", type=int, default=19999)
+    parser.add_argument("--access-token", default="bench-token")
+    parser.add_argument("--admin-delay-ms", type=float, default=0)
+    parser.add_argument("--admin-fail-rate", type=float, default=0)
+    parser.add_argument("--http-error", action="store_true")
+    parser.add_argument("--max-workers", type=int, default=30)
+    parser.add_argument("--task-queue-length", type=int, default=30)
+    parser.add_argument("--http-retry-times", type=int, default=9)
+    parser.add_argument("--http-retry-duration", type=int, default=10)
+    parser.add_argument("--http-timeout", type=int, default=60)
+    parser.add_argument("--drain-timeout", type=float, default=30)
+    asyncio.run(_main(parser.parse_args()))
@@ -0,0 +1,60 @@
+"""
+log calls per second benchmark
+
+usage:
+    LOG_FORMAT=json LOG_PATH=/tmp/bench_log python -m benchmarks.logger_bench
+    LOG_FORMAT=text LOG_PATH=/tmp/bench_log python -m benchmarks.logger_bench
+"""
+import argparse
+import io
+import json
+import sys
+import time
+
+# silence stdout sinks while measuring, the sinks bind sys.stdout when the logger is imported
+_stdout = sys.stdout
+sys.stdout = io.StringIO()
+
+from app.common.logger import apply_log_config, log, log_mode, shutdown_log  # noqa: E402
+
+PAYLOAD = {"database": {"host": "127.0.0.1", "port": 3306}, "tables": list(range(50))}
+
+
+def _bench(name: str, func, count: int) -> tuple[str, float]:
+    start = time.perf_counter()
+    for _ in range(count):
+        func()
+    elapsed = time.perf_counter() - start
+    return name, count / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--count", type=int, default=50_000)
+    args = parser.parse_args()
+    n = args.count
+
+    results = [
+        _bench("info plain", lambda: log.info("processed one row"), n),
+        _bench("info eager json.dumps", lambda: log.info(f"config:{json.dumps(PAYLOAD)}"), n),
+        _bench("debug eager json.dumps (filtered)", lambda: log.debug(f"config:{json.dumps(PAYLOAD)}"), n),
+        _bench("debug lazy json.dumps (filtered)",
+               lambda: log.opt(lazy=True).debug("config:{}", lambda: json.dumps(PAYLOAD)), n),
+    ]
+    apply_log_config({"level": "INFO", "sampling": {__name__: 0.1}})
+    results.append(_bench("info sampled 10%", lambda: log.info("processed one row"), n))
+    apply_log_config(None)
+
+    flush_start = time.perf_counter()
+    shutdown_log()
+    flush_elapsed = time.perf_counter() - flush_start
+
+    sys.stdout = _stdout
+    print(f"log mode: {log_mode}, calls per case: {n}")
+    for name, rate in results:
+        print(f"{name:<40} {rate:>12,.0f} calls/s")
+    print(f"{'drain sinks on shutdown':<40} {flush_elapsed:>12.3f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""
+minimal OTLP/HTTP json collector stand-in, receives span batches on /v1/traces and
+writes one span per line with its parent, for local inspection of the span trees
+
+usage:
+    python -m benchmarks.otlp_collector_sim --port 4318 --output /tmp/otlp_spans.jsonl
+    TRACE_SAMPLE_RATE=1 TRACE_EXPORTER=otlp:http://127.0.0.1:4318/v1/traces uvicorn ...
+"""
+import argparse
+import json
+
+from aiohttp import web
+
+
+def create_app(output: str) -> web.Application:
+    async def traces(request: web.Request) -> web.Response:
+        body = await request.json()
+        count = 0
+        with open(output, "a", encoding="utf-8") as f:
+            for resource_spans in body.get("resourceSpans", []):
+                for scope_spans in resource_spans.get("scopeSpans", []):
+                    for span in scope_spans.get("spans", []):
+                        duration_ms = (int(span["endTimeUnixNano"]) - int(span["startTimeUnixNano"])) / 1e6
+                        attrs = {a["key"]: next(iter(a["value"].values())) for a in span.get("attributes", [])}
+                        f.write(json.dumps({
+                            "traceId": span["traceId"],
+                            "spanId": span["spanId"],
+                            "parentSpanId": span.get("parentSpanId"),
+                            "name": span["name"],
+                            "duration_ms": duration_ms,
+                            "status": span.get("status", {}).get("code"),
+                            "attributes": attrs,
+                        }, ensure_ascii=False) + "\n")
+                        count += 1
+        print(f"received {count} spans")
+        return web.json_response({"partialSuccess": {}})
+
+    app = web.Application()
+    app.router.add_post("/v1/traces", traces)
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=4318)
+    parser.add_argument("--output", default="otlp_spans.jsonl")
+    args = parser.parse_args()
+    web.run_app(create_app(args.output), host=args.host, port=args.port, access_log=None)
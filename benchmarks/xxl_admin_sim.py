@@ -0,0 +1,198 @@
+"""
+lightweight local stand-in of xxl-job admin
+
+accepts executor registration and callbacks (api path /xxl-job-admin/api/) and fires triggers
+at the executor /run endpoint, admin slowness and failures can be injected
+
+usage (standalone, triggers a registered executor):
+    python -m benchmarks.xxl_admin_sim --port 18080 --handler refresh_nacos_config_task --rate 5 --duration 30
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from aiohttp import ClientSession, ClientTimeout, web
+
+API_PATH = "/xxl-job-admin/api/"
+
+
+class XxlAdminSimulator:
+
+    def __init__(self, access_token: str = None, delay_ms: float = 0, fail_rate: float = 0,
+                 http_error: bool = False):
+        """
+        :param access_token: 与执行器一致的token，为空时不校验
+        :param delay_ms: 每个admin接口的处理延迟（模拟admin变慢）
+        :param fail_rate: admin接口失败的比例
+        :param http_error: 失败时返回HTTP 500（否则返回 code=500 的业务错误）
+        """
+        self.access_token = access_token
+        self.delay_ms = delay_ms
+        self.fail_rate = fail_rate
+        self.http_error = http_error
+        # registryKey -> {registryValue: last registry time}
+        self.registry: dict[str, dict[str, float]] = {}
+        # logId -> trigger / callback bookkeeping
+        self.triggers: dict[int, dict] = {}
+        self.admin_requests = {"registry": 0, "registryRemove": 0, "callback": 0, "failed": 0}
+        self._session: ClientSession | None = None
+        self._runner: web.AppRunner | None = None
+        self._next_log_id = 1
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(API_PATH + "registry", self._registry)
+        app.router.add_post(API_PATH + "registryRemove", self._registry_remove)
+        app.router.add_post(API_PATH + "callback", self._callback)
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 18080):
+        self._runner = web.AppRunner(self.create_app(), access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        self._session = ClientSession(timeout=ClientTimeout(total=30))
+
+    async def stop(self):
+        if self._session is not None:
+            await self._session.close()
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    async def _admin_response(self, request: web.Request, path: str, handle):
+        self.admin_requests[path] += 1
+        if self.access_token and request.headers.get("XXL-JOB-ACCESS-TOKEN") != self.access_token:
+            return web.json_response({"code": 500, "msg": "The access token is wrong."})
+        if self.delay_ms:
+            await asyncio.sleep(self.delay_ms / 1000)
+        if self.fail_rate and random.random() < self.fail_rate:
+            self.admin_requests["failed"] += 1
+            if self.http_error:
+                return web.Response(status=500, text="simulated admin failure")
+            return web.json_response({"code": 500, "msg": "simulated admin failure"})
+        handle(await request.json())
+        return web.json_response({"code": 200, "msg": None})
+
+    async def _registry(self, request: web.Request):
+        def handle(data):
+            self.registry.setdefault(data["registryKey"], {})[data["registryValue"]] = time.time()
+        return await self._admin_response(request, "registry", handle)
+
+    async def _registry_remove(self, request: web.Request):
+        def handle(data):
+            self.registry.get(data["registryKey"], {}).pop(data["registryValue"], None)
+        return await self._admin_response(request, "registryRemove", handle)
+
+    async def _callback(self, request: web.Request):
+        def handle(data):
+            now = time.time()
+            for item in data:
+                trigger = self.triggers.get(item["logId"])
+                if trigger is not None and "callback_time" not in trigger:
+                    trigger["callback_time"] = now
+                    trigger["handle_code"] = item["handleCode"]
+                    trigger["handle_msg"] = item["handleMsg"]
+        return await self._admin_response(request, "callback", handle)
+
+    async def wait_registered(self, app_name: str, timeout: float = 30) -> list[str]:
+        """wait until an executor of the app registers, returns the executor addresses"""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self.registry.get(app_name):
+                return list(self.registry[app_name])
+            await asyncio.sleep(0.1)
+        raise TimeoutError(f"no executor of {app_name} registered in {timeout}s")
+
+    async def trigger(self, executor_url: str, handler: str, job_id: int, params: str = None,
+                      block_strategy: str = "SERIAL_EXECUTION", timeout: int = 0,
+                      broadcast_index: int = 0, broadcast_total: int = 1) -> dict:
+        """fire one trigger at the executor, like the admin scheduler does"""
+        log_id = self._next_log_id
+        self._next_log_id += 1
+        now = time.time()
+        trigger = self.triggers[log_id] = {"jobId": job_id, "handler": handler, "trigger_time": now}
+        payload = {
+            "jobId": job_id,
+            "executorHandler": handler,
+            "executorParams": params,
+            "executorBlockStrategy": block_strategy,
+            "executorTimeout": timeout,
+            "logId": log_id,
+            "logDateTime": int(now * 1000),
+            "glueType": "BEAN",
+            "glueSource": "",
+            "glueUpdatetime": int(now * 1000),
+            "broadcastIndex": broadcast_index,
+            "broadcastTotal": broadcast_total,
+        }
+        headers = {"XXL-JOB-ACCESS-TOKEN": self.access_token} if self.access_token else {}
+        try:
+            async with self._session.post(executor_url.rstrip("/") + "/run", json=payload, headers=headers) as resp:
+                body = await resp.json()
+                trigger["run_code"] = body.get("code")
+                trigger["run_msg"] = body.get("msg")
+        except Exception as e:
+            trigger["run_code"] = -1
+            trigger["run_msg"] = repr(e)
+        trigger["accept_time"] = time.time()
+        return trigger
+
+    async def fire(self, executor_url: str, handler: str, rate: float, duration: float, jobs: int = 1,
+                   params: str = None, block_strategy: str = "SERIAL_EXECUTION"):
+        """fire triggers at a fixed rate for duration seconds, round robin over jobs distinct jobIds"""
+        interval = 1 / rate
+        start = time.perf_counter()
+        pending = set()
+        count = 0
+        while time.perf_counter() - start < duration:
+            job_id = count % jobs + 1
+            task = asyncio.create_task(self.trigger(executor_url, handler, job_id, params, block_strategy))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+            count += 1
+            # fixed schedule, a slow trigger does not delay the next one
+            await asyncio.sleep(max(0.0, start + count * interval - time.perf_counter()))
+        if pending:
+            await asyncio.wait(pending)
+
+    async def wait_callbacks(self, timeout: float = 60):
+        """wait until every accepted trigger has its callback"""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            waiting = [t for t in self.triggers.values() if t.get("run_code") == 200 and "callback_time" not in t]
+            if not waiting:
+                return
+            await asyncio.sleep(0.1)
+
+
+async def _main(args):
+    simulator = XxlAdminSimulator(args.access_token, args.delay_ms, args.fail_rate, args.http_error)
+    await simulator.start(args.host, args.port)
+    print(f"xxl-job admin simulator on http://{args.host}:{args.port}{API_PATH}")
+    try:
+        executors = await simulator.wait_registered(args.app_name, timeout=args.register_timeout)
+        print(f"executor registered: {executors}")
+        await simulator.fire(executors[0], args.handler, args.rate, args.duration, args.jobs, args.params)
+        await simulator.wait_callbacks()
+        done = [t for t in simulator.triggers.values() if "callback_time" in t]
+        print(f"triggers={len(simulator.triggers)} callbacks={len(done)} admin requests={simulator.admin_requests}")
+    finally:
+        await simulator.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18080)
+    parser.add_argument("--app-name", default="xxl-job-executor-sample")
+    parser.add_argument("--access-token", default=None)
+    parser.add_argument("--handler", required=True)
+    parser.add_argument("--params", default=None)
+    parser.add_argument("--rate", type=float, default=1, help="triggers per second")
+    parser.add_argument("--duration", type=float, default=10, help="seconds")
+    parser.add_argument("--jobs", type=int, default=1, help="distinct jobIds, pyxxl runs one trigger per jobId at a time")
+    parser.add_argument("--delay-ms", type=float, default=0, help="admin api latency")
+    parser.add_argument("--fail-rate", type=float, default=0, help="admin api failure ratio")
+    parser.add_argument("--http-error", action="store_true", help="fail with http 500 instead of code 500")
+    parser.add_argument("--register-timeout", type=float, default=60)
+    asyncio.run(_main(parser.parse_args()))
@@ -0,0 +1,81 @@
+import re
+
+import pandas as pd
+import pytest
+
+from app.xxl_job import batch_job
+from app.xxl_job.batch_job import ChunkedBatchJob
+
+ROWS = pd.DataFrame({"id": range(1, 11), "v": range(10)})
+
+
+@pytest.fixture
+def progress(monkeypatch):
+    # in memory progress table, keyed like its primary key
+    rows = {}
+
+    def query_dict(db, sql, params=None):
+        if "COUNT(*)" in sql:
+            lower = int(re.search(r"> (-?\d+)", sql).group(1))
+            return [{"cnt": int((ROWS["id"] > lower).sum())}]
+        return [{"start_key": start, "end_key": end, "row_count": count}
+                for (job, run, start), (end, count) in rows.items()
+                if (job, run) == (params["job_name"], params["run_key"])]
+
+    def insert(db, sql, params):
+        rows[params["job_name"], params["run_key"], params["start_key"]] = (params["end_key"], params["row_count"])
+
+    def update(db, sql, params):
+        for key in [key for key in rows if key[:2] == (params["job_name"], params["run_key"])]:
+            del rows[key]
+
+    def read_chunk(db, sql):
+        lower = int(re.search(r"> (-?\d+)", sql).group(1))
+        limit = int(re.search(r"LIMIT (\d+)", sql).group(1))
+        return ROWS[ROWS["id"] > lower].head(limit).reset_index(drop=True)
+
+    monkeypatch.setattr(batch_job, "execute_sql", lambda db, sql: None)
+    monkeypatch.setattr(batch_job, "query_mysql_to_dict", query_dict)
+    monkeypatch.setattr(batch_job, "insert_mysql", insert)
+    monkeypatch.setattr(batch_job, "update_mysql", update)
+    monkeypatch.setattr(batch_job, "query_mysql_to_df", read_chunk)
+    return rows
+
+
+def _job(processed, fail_on=None):
+    def process(df):
+        if fail_on is not None and fail_on in df["id"].values:
+            raise RuntimeError("chunk failed")
+        processed.extend(df["id"])
+
+    return ChunkedBatchJob("job", "db", "tb", process, chunk_size=3, workers=2, run_key="2026-10-19")
+
+
+def test_resume_after_failure(progress):
+    processed = []
+    with pytest.raises(RuntimeError):
+        _job(processed, fail_on=5).run()
+    assert 5 not in processed
+
+    resumed = []
+    summary = _job(resumed).run()
+    # only the failed chunk and the ones not checkpointed are processed again
+    assert sorted(set(processed) | set(resumed)) == list(range(1, 11))
+    assert set(processed) & set(resumed) == set()
+    assert summary["already_completed"] is False
+
+
+def test_rerun_of_completed_run_is_reported(progress):
+    first = []
+    assert _job(first).run()["rows"] == 10
+    assert sorted(first) == list(range(1, 11))
+
+    again = []
+    summary = _job(again).run()
+    assert again == []
+    assert summary["already_completed"] is True
+
+    job = _job(again)
+    job.reset()
+    assert job.run()["rows"] == 10
+    assert sorted(again) == list(range(1, 11))
@@ -0,0 +1,53 @@
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+
+from app.config.db.df_dtype import (DOWNCAST_FLOAT, DOWNCAST_INT, STRING_DTYPE, apply_schema, concat_chunks,
+                                    infer_schema)
+
+
+def _chunk(offset: int, cities: list[str]) -> pd.DataFrame:
+    rows = len(cities)
+    return pd.DataFrame({
+        "id": np.arange(offset, offset + rows, dtype="int64"),
+        "amount": np.linspace(0, 1, rows),
+        "city": pd.Series(cities, dtype=object),
+        "name": pd.Series([f"name-{offset + i}" for i in range(rows)], dtype=object),
+        "price": pd.Series([Decimal("1.10")] * rows, dtype=object),
+        "empty": pd.Series([None] * rows, dtype=object),
+    })
+
+
+def test_infer_schema():
+    schema = infer_schema(_chunk(0, ["a", "b", "a", "b"]))
+    # Decimal and all null columns keep their dtype
+    assert schema == {"id": DOWNCAST_INT, "amount": DOWNCAST_FLOAT, "city": "category", "name": STRING_DTYPE}
+    assert infer_schema(_chunk(0, ["a", "b", "c", "d"]), category_ratio=0.5)["city"] == STRING_DTYPE
+
+
+def test_apply_schema_keeps_values():
+    df = _chunk(0, ["a", "b", "a", "b"])
+    optimized = apply_schema(df.copy(), infer_schema(df))
+    assert optimized["id"].dtype == np.int8
+    assert optimized["amount"].dtype == np.float32
+    assert optimized["id"].tolist() == df["id"].tolist()
+    assert optimized["city"].astype(object).tolist() == df["city"].tolist()
+    assert optimized["price"].tolist() == df["price"].tolist()
+
+
+def test_concat_chunks_keeps_categories():
+    first = _chunk(0, ["a", "b", "a", "b"])
+    schema = infer_schema(first)
+    chunks = [apply_schema(first, schema), apply_schema(_chunk(4, ["c", "a", "c", "c"]), schema)]
+    result = concat_chunks(chunks)
+    assert isinstance(result["city"].dtype, pd.CategoricalDtype)
+    assert result["city"].astype(object).tolist() == ["a", "b", "a", "b", "c", "a", "c", "c"]
+    assert result["id"].tolist() == list(range(8))
+    assert result.index.tolist() == list(range(8))
+
+
+def test_concat_chunks_edge_cases():
+    assert concat_chunks([]).empty
+    chunk = _chunk(0, ["a"])
+    assert concat_chunks([chunk]) is chunk
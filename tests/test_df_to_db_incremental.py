@@ -0,0 +1,118 @@
+from datetime import date, datetime
+from decimal import Decimal
+
+import pandas as pd
+import pytest
+
+import app.config.db.db_mysql as db_mysql
+
+
+class _Connection:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execution_options(self, **options):
+        return self
+
+
+class _Engine:
+
+    def connect(self):
+        return _Connection()
+
+
+@pytest.fixture
+def table(monkeypatch):
+    """rows of the table as the driver returns them, read in chunks of 2"""
+    state = {"rows": None, "upserted": None, "deleted": None}
+
+    def read_sql_query(sql, conn, chunksize, **kwargs):
+        rows = state["rows"]
+        return iter([rows.iloc[i:i + chunksize].copy() for i in range(0, len(rows), chunksize)])
+
+    def delete_keys(engine, tb_name, keys, rows):
+        state["deleted"] = rows
+        return len(rows)
+
+    monkeypatch.setattr(db_mysql, "get_engine_by_db", lambda db_name: _Engine())
+    monkeypatch.setattr(db_mysql.pd, "read_sql_query", lambda sql, conn, chunksize, **kwargs:
+                        read_sql_query(sql, conn, 2, **kwargs))
+    monkeypatch.setattr(db_mysql, "_upsert_df", lambda df, *args: state.__setitem__("upserted", df))
+    monkeypatch.setattr(db_mysql, "_delete_keys", delete_keys)
+    return state
+
+
+def _df():
+    return pd.DataFrame({
+        "id": [1, 2, 3, 2 ** 60 + 1],
+        "price": [1.5, 2.0, 3.25, 4.0],
+        "day": pd.to_datetime(["2024-01-01", "2024-01-02", "2024-01-03", "2024-01-04"]),
+        "updated": pd.to_datetime(["2024-01-01 10:00:00.123456", "2024-01-02", "2024-01-03", "2024-01-04"], format="ISO8601"),
+        "name": ["a", None, "c", "d"],
+        "qty": pd.array([1, None, 3, 4], dtype="Int64"),
+        "flag": [True, False, True, False],
+    })
+
+
+def _table_rows():
+    # DECIMAL, DATE, DATETIME(6), VARCHAR, INT NULL, TINYINT as returned by pymysql
+    return pd.DataFrame({
+        "id": [1, 2, 3, 2 ** 60 + 1],
+        "price": [Decimal("1.50"), Decimal("2.00"), Decimal("3.25"), Decimal("4.00")],
+        "day": [date(2024, 1, 1), date(2024, 1, 2), date(2024, 1, 3), date(2024, 1, 4)],
+        "updated": [datetime(2024, 1, 1, 10, 0, 0, 123456), datetime(2024, 1, 2), datetime(2024, 1, 3),
+                    datetime(2024, 1, 4)],
+        "name": ["a", None, "c", "d"],
+        "qty": [1, None, 3, 4],
+        "flag": [1, 0, 1, 0],
+    })
+
+
+def test_equal_values_of_other_types_are_not_changes(table):
+    table["rows"] = _table_rows()
+    stats = db_mysql.df_to_db_incremental(_df(), "db", "t", ["id"])
+    assert stats == {"inserted": 0, "changed": 0, "skipped": 4, "deleted": 0}
+    assert table["upserted"] is None
+
+
+def test_changed_new_and_missing_rows(table):
+    rows = _table_rows()
+    rows.loc[0, "price"] = Decimal("1.60")
+    rows.loc[2, "id"] = 99
+    table["rows"] = rows
+    # a neighbouring big id must not be confused with 2 ** 60 + 1
+    df = _df()
+    df.loc[3, "qty"] = 5
+
+    stats = db_mysql.df_to_db_incremental(df, "db", "t", ["id"], delete_missing=True)
+    assert stats == {"inserted": 1, "changed": 2, "skipped": 1, "deleted": 1}
+    assert sorted(table["upserted"]["id"]) == [1, 3, 2 ** 60 + 1]
+    assert table["deleted"]["id"].tolist() == [99]
+
+
+def test_null_key_rows_of_the_table_are_ignored(table):
+    rows = _table_rows()
+    # numpy_nullable dtype backend: an integer key with NULLs is read as Int64
+    rows["id"] = pd.array([1, None, None, 2 ** 60 + 1], dtype="Int64")
+    table["rows"] = rows
+    stats = db_mysql.df_to_db_incremental(_df(), "db", "t", ["id"], delete_missing=True)
+    assert stats == {"inserted": 2, "changed": 0, "skipped": 2, "deleted": 0}
+
+
+@pytest.mark.parametrize("ids", [[1, 1, 2, 3], [1, None, 2, 3]])
+def test_duplicate_or_null_keys_of_the_dataframe_are_rejected(table, ids):
+    table["rows"] = _table_rows()
+    df = _df()
+    df["id"] = ids
+    with pytest.raises(ValueError):
+        db_mysql.df_to_db_incremental(df, "db", "t", ["id"])
+
+
+def test_empty_table_inserts_everything(table):
+    table["rows"] = _table_rows().iloc[:0]
+    stats = db_mysql.df_to_db_incremental(_df(), "db", "t", ["id"], delete_missing=True)
+    assert stats == {"inserted": 4, "changed": 0, "skipped": 0, "deleted": 0}
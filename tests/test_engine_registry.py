@@ -0,0 +1,67 @@
+import sqlite3
+
+import pytest
+from sqlalchemy import create_engine
+
+import app.config.db.db_mysql as db_mysql
+from app.config.db.engine_registry import EngineRegistry, _PoolEntry
+
+
+class _SchemaConnection(sqlite3.Connection):
+    """sqlite connection recording the schema selections of the registry (pymysql select_db)"""
+    selected = []
+
+    def select_db(self, schema):
+        self.selected.append((id(self), schema))
+
+
+def _connect():
+    return sqlite3.connect(":memory:", factory=_SchemaConnection, check_same_thread=False)
+
+
+def test_schema_is_selected_again_after_a_reconnect():
+    _SchemaConnection.selected = []
+    registry = EngineRegistry({})
+    entry = _PoolEntry(("h", 3306, "u"), create_engine("sqlite://", creator=_connect), 5)
+    registry._listen(entry)
+    engine = entry.engine.execution_options(schema="webgis_bi")
+
+    with engine.connect() as conn:
+        conn.exec_driver_sql("SELECT 1")
+        conn.exec_driver_sql("SELECT 1")
+        first = conn.connection.dbapi_connection
+        conn.invalidate()
+        conn.rollback()
+        conn.exec_driver_sql("SELECT 1")
+        second = conn.connection.dbapi_connection
+
+    assert first is not second
+    assert _SchemaConnection.selected == [(id(first), "webgis_bi"), (id(second), "webgis_bi")]
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    registry = EngineRegistry({"host": "nacos-host", "user": "u", "password": "p"})
+    monkeypatch.setattr(db_mysql, "_engine_registry", registry)
+    monkeypatch.setattr(db_mysql, "db_dict", db_mysql._EngineDict())
+    yield registry
+    registry.dispose_all()
+
+
+def test_get_engine_registers_the_settings(registry):
+    engine = db_mysql.get_engine("report", "reader", "secret", host="10.0.0.2", port=3307)
+    assert (engine.url.host, engine.url.port, engine.url.username) == ("10.0.0.2", 3307, "reader")
+    assert engine.get_execution_options()["schema"] == "report"
+    assert db_mysql.get_engine_by_db("report") is engine
+    assert db_mysql.db_dict["report"] is engine
+    # other databases keep the nacos settings
+    assert db_mysql.get_engine_by_db("webgis_bi").url.host == "nacos-host"
+
+    moved = db_mysql.get_engine("report", "reader", "secret", host="10.0.0.3")
+    assert moved.url.host == "10.0.0.3"
+
+
+def test_assigned_engines_win(registry):
+    engine = create_engine("sqlite://")
+    db_mysql.db_dict["local"] = engine
+    assert db_mysql.get_engine_by_db("local") is engine
@@ -0,0 +1,19 @@
+import os
+from datetime import datetime, timedelta
+
+from app.common.logger import JsonBatchSink, log_retention_days
+
+
+def test_clean_expired_only_deletes_daily_files(tmp_path):
+    old = (datetime.now() - timedelta(days=log_retention_days + 1)).strftime("%Y-%m-%d")
+    recent = datetime.now().strftime("%Y-%m-%d")
+    names = [f"{old}.log", f"{recent}.log", "app.log", "0-debug.log", f"{old}-backup.log", f"{old}.log.gz"]
+    for name in names:
+        (tmp_path / name).write_text("x")
+
+    sink = JsonBatchSink(str(tmp_path), stream=None)
+    try:
+        sink._clean_expired()
+    finally:
+        sink.stop()
+    assert sorted(os.listdir(tmp_path)) == sorted(names[1:])
@@ -0,0 +1,67 @@
+import multiprocessing
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("fcntl")
+
+from app.config.shared_config import SharedConfigSnapshot
+
+WRITERS = 4
+PUBLISHES = 50
+
+
+def _value(writer: int, n: int) -> dict:
+    # the payload size varies so writers grow the file while others read
+    return {"writer": writer, "n": n, "blob": "x" * (n * 997 % 20000), "check": writer * 100000 + n}
+
+
+def _write(directory: str, writer: int, versions):
+    snapshot = SharedConfigSnapshot("concurrent", directory)
+    for n in range(PUBLISHES):
+        with snapshot.write_lock():
+            versions.put(snapshot.publish(_value(writer, n)))
+
+
+def test_concurrent_writers_and_readers(tmp_path):
+    directory = str(tmp_path / "shm")
+    reader = SharedConfigSnapshot("concurrent", directory)
+    assert reader.read() is None
+
+    context = multiprocessing.get_context("spawn")
+    versions = context.Queue()
+    writers = [context.Process(target=_write, args=(directory, i, versions)) for i in range(WRITERS)]
+    for process in writers:
+        process.start()
+
+    seen = 0
+    while any(process.is_alive() for process in writers):
+        value = reader.read()
+        if value is not None:
+            # never a torn payload: every field belongs to the same publish
+            assert value == _value(value["writer"], value["n"])
+            seen += 1
+    for process in writers:
+        process.join()
+        assert process.exitcode == 0
+
+    published = sorted(versions.get(timeout=10) for _ in range(WRITERS * PUBLISHES))
+    assert published == list(range(1, WRITERS * PUBLISHES + 1))
+    assert reader.read()["n"] == PUBLISHES - 1
+    assert seen > 0
+
+
+def test_refresher_syncs_non_leaders(tmp_path):
+    directory = str(tmp_path / "shm")
+    leader = SharedConfigSnapshot("refresh", directory)
+    follower = SharedConfigSnapshot("refresh", directory)
+    assert leader.try_lead()
+    # flock is per open file, the second mapping of the same process is not the leader
+    assert not follower.try_lead()
+
+    refreshed, synced = [], threading.Event()
+    follower.start_refresher(lambda: refreshed.append(1), 0.1, sync=synced.set, sync_interval=0.02)
+    assert synced.wait(2)
+    time.sleep(0.3)
+    assert refreshed == []
@@ -0,0 +1,63 @@
+import contextvars
+
+import pymysql.converters
+from pymysql.cursors import Cursor
+
+from app.config.db.db_mysql import _traced_statement
+from app.config.trace_.request_context import set_trace_id
+from app.config.trace_.span import trace_sql_comment
+
+
+def _in_trace(trace_id, func, *args):
+    def run():
+        set_trace_id(trace_id)
+        return func(*args)
+    return contextvars.copy_context().run(run)
+
+
+def test_trace_sql_comment_keeps_safe_characters_only():
+    assert _in_trace("abc-123_X", trace_sql_comment) == "/* trace_id=abc-123_X */ "
+    assert _in_trace("a%s*/ DROP TABLE t; --", trace_sql_comment) == "/* trace_id=asDROPTABLEt-- */ "
+    assert _in_trace("x" * 100, trace_sql_comment) == f"/* trace_id={'x' * 64} */ "
+
+
+def test_trace_sql_comment_empty_without_safe_trace_id():
+    assert trace_sql_comment() == ""
+    assert _in_trace("%%*/", trace_sql_comment) == ""
+
+
+class _FakeConnection:
+    encoding = "utf8"
+
+    def __init__(self):
+        self.queries = []
+
+    def literal(self, obj):
+        return pymysql.converters.escape_item(obj, "utf8")
+
+    def escape(self, obj, mapping=None):
+        return pymysql.converters.escape_item(obj, "utf8", mapping)
+
+
+class _RecordingCursor(Cursor):
+
+    def execute(self, query, args=None):
+        query = self.mogrify(query, args)
+        self.connection.queries.append(query if isinstance(query, str) else query.decode())
+        return 1
+
+
+def test_traced_executemany_insert_is_one_statement():
+    statement = "INSERT INTO `user` (name, age) VALUES (%(name)s, %(age)s)"
+    traced = _in_trace("trace-1", _traced_statement, statement, True)
+    assert "trace_id=trace-1" in traced
+
+    connection = _FakeConnection()
+    _RecordingCursor(connection).executemany(traced, [{"name": f"n{i}", "age": i} for i in range(100)])
+    assert len(connection.queries) == 1
+    assert connection.queries[0].startswith("INSERT /* trace_id=trace-1 */ INTO")
+
+
+def test_traced_single_statement_has_leading_comment():
+    assert _in_trace("t1", _traced_statement, "SELECT 1", False) == "/* trace_id=t1 */ SELECT 1"
+    assert _in_trace("t1", _traced_statement, "UPDATE t SET a = %s", True) == "/* trace_id=t1 */ UPDATE t SET a = %s"
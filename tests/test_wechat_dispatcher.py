@@ -0,0 +1,69 @@
+import asyncio
+import os
+import threading
+import time
+
+import pytest
+
+from app.common.utils import wechat_msg_util
+from app.common.utils.wechat_msg_util import WechatDispatcher
+
+
+@pytest.fixture
+def gate(monkeypatch):
+    gate = threading.Event()
+    sent = []
+
+    async def send_core(session, robot_key, payload):
+        await asyncio.get_running_loop().run_in_executor(None, gate.wait)
+        sent.append(payload["n"])
+        return True
+
+    monkeypatch.setattr(wechat_msg_util, "_send_wechat_message_core", send_core)
+    gate.sent = sent
+    return gate
+
+
+def _wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_bounded_queue_and_flush_on_close(gate):
+    dispatcher = WechatDispatcher(queue_size=2, pool_size=1, put_timeout=0.1)
+    first = dispatcher.submit("key", {"n": 0})
+    _wait_for(lambda: dispatcher.get_metrics()["in_flight"] == 1)
+    queued = [dispatcher.submit("key", {"n": n}) for n in (1, 2)]
+    assert dispatcher.get_metrics()["queued"] == 2
+
+    # the queue is full: dropped right away without blocking, after put_timeout when blocking
+    assert dispatcher.submit("key", {"n": 3}, block=False) is None
+    start = time.monotonic()
+    assert dispatcher.submit("key", {"n": 4}) is None
+    assert time.monotonic() - start >= 0.1
+
+    gate.set()
+    dispatcher.close()
+    assert [future.result(0) for future in [first, *queued]] == [True, True, True]
+    assert gate.sent == [0, 1, 2]
+    metrics = dispatcher.get_metrics()
+    assert (metrics["submitted"], metrics["sent"], metrics["dropped"], metrics["queued"]) == (3, 3, 2, 0)
+    assert dispatcher.submit("key", {"n": 5}) is None
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="fork only")
+def test_close_in_forked_child_returns_immediately(gate):
+    gate.set()
+    dispatcher = WechatDispatcher()
+    pid = os.fork()
+    if pid == 0:
+        start = time.monotonic()
+        dispatcher.close()
+        os._exit(0 if time.monotonic() - start < 1 else 1)
+    _, status = os.waitpid(pid, 0)
+    assert os.waitstatus_to_exitcode(status) == 0
+    # the parent dispatcher is untouched
+    assert dispatcher.send("key", {"n": 0})
+    dispatcher.close()
@@ -0,0 +1,108 @@
+import asyncio
+import time
+
+import pytest
+from pyxxl.ctx import g
+from pyxxl.error import JobDuplicateError
+from pyxxl.schema import RunData
+
+import app.config.xxl_job_config as xxl_job_config
+from app.common.const import TaskOverlapPolicy
+from app.config.db.query_deadline import get_query_scope, query_timeout
+
+
+async def _hold(limiter, log_id, started, release, results):
+    try:
+        async with limiter.slot(log_id):
+            started.append(log_id)
+            await release.wait()
+            results.append(log_id)
+    except asyncio.CancelledError:
+        results.append(f"cancelled {log_id}")
+        raise
+
+
+def _run_limiter(limiter, log_ids):
+    async def main():
+        started, results, release = [], [], asyncio.Event()
+        tasks = []
+        for log_id in log_ids:
+            tasks.append(asyncio.create_task(_hold(limiter, log_id, started, release, results)))
+            await asyncio.sleep(0.01)
+        running = list(started)
+        release.set()
+        outcomes = await asyncio.gather(*tasks, return_exceptions=True)
+        return running, results, outcomes
+    return asyncio.run(main())
+
+
+def test_block_waits_for_a_free_slot():
+    running, results, _ = _run_limiter(xxl_job_config._TaskLimiter("t", 2, TaskOverlapPolicy.BLOCK), [1, 2, 3])
+    assert running == [1, 2]
+    assert sorted(results) == [1, 2, 3]
+
+
+def test_discard_rejects_the_new_trigger():
+    running, results, outcomes = _run_limiter(xxl_job_config._TaskLimiter("t", 1, TaskOverlapPolicy.DISCARD), [1, 2])
+    assert running == [1]
+    assert results == [1]
+    assert isinstance(outcomes[1], JobDuplicateError)
+
+
+def test_replace_cancels_the_earliest_run():
+    running, results, outcomes = _run_limiter(xxl_job_config._TaskLimiter("t", 1, TaskOverlapPolicy.REPLACE), [1, 2])
+    assert running == [1, 2]
+    assert results == ["cancelled 1", 2]
+    assert isinstance(outcomes[0], asyncio.CancelledError)
+
+
+def test_overlap_without_max_concurrency_runs_one_at_a_time():
+    limiter = xxl_job_config._TaskLimiter("t", None, TaskOverlapPolicy.DISCARD)
+    assert limiter.max_concurrency == 1
+    assert xxl_job_config._TaskLimiter("t", None, None).max_concurrency is None
+
+
+def process_task(mode: str, outcome_path: str = None):
+    """runs in the process pool worker"""
+    scope = get_query_scope()
+    if mode == "deadline":
+        return scope.remaining()
+    outcome = "not cancelled"
+    started = time.monotonic()
+    while time.monotonic() - started < 10:
+        if g.cancel_event.is_set() and scope.cancelled:
+            outcome = "cancelled"
+            break
+        time.sleep(0.05)
+    with open(outcome_path, "w") as f:
+        f.write(outcome)
+
+
+@pytest.fixture
+def process_pool(monkeypatch):
+    monkeypatch.setattr(xxl_job_config, "get_config", lambda: {"xxl-job": {"process_workers": 1}})
+    yield
+    if xxl_job_config._process_pool is not None:
+        xxl_job_config._process_pool.shutdown(wait=True, cancel_futures=True)
+        xxl_job_config._process_pool = None
+
+
+def test_process_task_gets_the_deadline_and_the_cancel(process_pool, tmp_path):
+    outcome_path = tmp_path / "outcome"
+    data = RunData(jobId=1, logId=1, executorHandler="t", executorBlockStrategy="SERIAL_EXECUTION")
+
+    async def main():
+        with query_timeout(30):
+            remaining = await xxl_job_config._run_in_process(process_task, data, ("deadline",), {})
+        task = asyncio.create_task(xxl_job_config._run_in_process(process_task, data, ("cancel", str(outcome_path)), {}))
+        await asyncio.sleep(3)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return remaining
+
+    remaining = asyncio.run(main())
+    assert 0 < remaining <= 30
+    # the cancelled run is not interrupted, it sees the cancel event and its query scope is cancelled
+    xxl_job_config._process_pool.shutdown(wait=True)
+    assert outcome_path.read_text() == "cancelled"
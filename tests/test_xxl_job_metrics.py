@@ -0,0 +1,38 @@
+import asyncio
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+from prometheus_client import REGISTRY, generate_latest
+from pyxxl import ExecutorConfig
+from pyxxl.schema import RunData
+
+from app.config import xxl_job_config
+from app.config.xxl_job_metrics import mount_metrics_routes, record_task_run
+
+
+def test_executor_app_serves_metrics_and_runs():
+    config = ExecutorConfig(xxl_admin_baseurl="http://127.0.0.1:1/xxl-job-admin/api/", executor_app_name="demo",
+                            executor_listen_host="127.0.0.1", executor_listen_port=19999)
+    app = xxl_job_config._TracedRunner(config, xxl_job_config._handler, {}).create_server_app()
+    paths = {resource.canonical for resource in app.router.resources()}
+    assert {"/metrics", "/runs"} <= paths
+
+
+def test_collectors_in_default_registry_and_runs_route():
+    data = RunData(logId=7, jobId=3, executorHandler="metrics_task",
+                   executorBlockStrategy="SERIAL_EXECUTION")
+    with record_task_run("metrics_task", data) as run:
+        run.started()
+    # pyxxl serves the default registry on /metrics of the executor port
+    assert b'xxl_task_runs_total{status="success",task="metrics_task"}' in generate_latest(REGISTRY)
+
+    async def get_runs():
+        app = web.Application()
+        mount_metrics_routes(app)
+        async with TestClient(TestServer(app)) as client:
+            resp = await client.get("/runs", params={"task": "metrics_task"})
+            assert resp.status == 200
+            return await resp.json()
+
+    runs = asyncio.run(get_runs())["metrics_task"]
+    assert [(r["logId"], r["jobId"], r["status"]) for r in runs] == [(7, 3, "success")]
@@ -0,0 +1,69 @@
+import contextvars
+
+import pytest
+from pyxxl.ctx import g
+from pyxxl.schema import RunData
+
+from app.config import xxl_job_sharding
+from app.config.xxl_job_sharding import Shard, get_shard, local_id_range, split_id_range
+
+
+def _in_task(func, executor_params: str = None, index: int = None, total: int = None):
+    def run():
+        g.set_xxl_run_data(RunData(jobId=1, logId=1, executorHandler="t", executorBlockStrategy="SERIAL_EXECUTION",
+                                   executorParams=executor_params, broadcastIndex=index, broadcastTotal=total))
+        return func()
+
+    return contextvars.copy_context().run(run)
+
+
+@pytest.mark.parametrize("min_id, max_id, total", [(1, 10, 3), (0, 0, 1), (-5, 5, 4), (1, 2 ** 40, 7)])
+def test_split_id_range_covers_the_range(min_id, max_id, total):
+    ranges = split_id_range(min_id, max_id, total)
+    assert len(ranges) == total
+    assert ranges[0][0] == min_id and ranges[-1][1] == max_id
+    # contiguous and almost the same size
+    assert all(ranges[i][1] + 1 == ranges[i + 1][0] for i in range(total - 1))
+    sizes = [end - start + 1 for start, end in ranges]
+    assert max(sizes) - min(sizes) <= 1
+
+
+def test_split_id_range_more_shards_than_ids():
+    assert split_id_range(1, 2, 4) == [(1, 1), (2, 2), (3, 2), (3, 2)]
+    with pytest.raises(ValueError):
+        split_id_range(1, 2, 0)
+
+
+def test_local_id_range_open_ends():
+    ranges = [local_id_range("db", "tb", shard=Shard(i, 3), id_bounds=(1, 10)) for i in range(3)]
+    assert ranges == [(None, 4), (5, 7), (8, None)]
+    assert local_id_range("db", "tb", shard=Shard(0, 1), id_bounds=(1, 10)) == (None, None)
+
+
+def test_local_id_range_more_shards_than_ids():
+    ranges = [local_id_range("db", "tb", shard=Shard(i, 4), id_bounds=(1, 2)) for i in range(4)]
+    # the empty middle shard reads nothing, the last one still reads the ids above the range
+    assert ranges == [(None, 1), (2, 2), None, (3, None)]
+
+
+def test_local_id_range_bounds_from_trigger_params(monkeypatch):
+    monkeypatch.setattr(xxl_job_sharding, "query_mysql_to_dict", lambda *args: pytest.fail("table queried"))
+    id_range = _in_task(lambda: local_id_range("db", "tb"), '{"min_id": 1, "max_id": 100}', 1, 2)
+    assert id_range == (51, None)
+    assert _in_task(get_shard, index=1, total=2) == Shard(1, 2)
+    assert get_shard() == Shard(0, 1)
+
+
+def test_local_id_range_bounds_from_table(monkeypatch):
+    queries = []
+
+    def query(db, sql):
+        queries.append(sql)
+        return [{"min_id": 11, "max_id": 20}]
+
+    monkeypatch.setattr(xxl_job_sharding, "query_mysql_to_dict", query)
+    assert local_id_range("db", "tb", where="status = 1", shard=Shard(0, 2)) == (None, 15)
+    assert queries == ["SELECT MIN(`id`) AS min_id, MAX(`id`) AS max_id FROM `tb` WHERE status = 1"]
+
+    monkeypatch.setattr(xxl_job_sharding, "query_mysql_to_dict", lambda db, sql: [{"min_id": None, "max_id": None}])
+    assert local_id_range("db", "tb", shard=Shard(0, 2)) is None